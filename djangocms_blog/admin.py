@@ -274,8 +274,11 @@ class BlogConfigAdmin(BaseAppHookConfig, TranslatableAdmin):
             }),
             ('Layout', {
                 'fields': (
-                    'config.paginate_by', 'config.url_patterns', 'config.template_prefix',
+                    'config.paginate_by', 'config.pagination_mode', 'config.pagination_count',
+                    'config.url_patterns', 'config.template_prefix',
                     'config.menu_structure', 'config.menu_empty_categories',
+                    'config.menu_posts_limit', 'config.menu_posts_per_category',
+                    'config.menu_posts_current_year',
                 ),
                 'classes': ('collapse',)
             }),
@@ -325,12 +328,14 @@ class BlogConfigAdmin(BaseAppHookConfig, TranslatableAdmin):
 
     def save_model(self, request, obj, form, change):
         """
-        Clear menu cache when changing menu structure
+        Clear menu cache when changing menu options
         """
-        if 'config.menu_structure' in form.changed_data:
-            from menus.menu_pool import menu_pool
-            menu_pool.clear(all=True)
-        return super(BlogConfigAdmin, self).save_model(request, obj, form, change)
+        menu_changed = any(field.startswith('config.menu_') for field in form.changed_data)
+        response = super(BlogConfigAdmin, self).save_model(request, obj, form, change)
+        if menu_changed:
+            from .cms_menus import clear_blog_menu_cache
+            clear_blog_menu_cache([obj.namespace])
+        return response
 
 admin.site.register(BlogCategory, BlogCategoryAdmin)
 admin.site.register(Post, PostAdmin)
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function, unicode_literals
+
+import time
+from uuid import uuid4
+
+from django.core.cache import cache
+from django.utils.encoding import force_text
+
+from .settings import get_setting
+
+POSTS_VERSION_KEY = 'djangocms-blog:posts:version'
+APP_CONFIG_VERSION_KEY = 'djangocms-blog:app-config:{0}:version'
+
+
+def get_cache_version(key):
+    """
+    Return the current value of the given version key, initializing it if missing
+    """
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid4().hex, timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_cache_version(key):
+    """
+    Change the value of the given version key, invalidating all the entries built on it
+    """
+    cache.set(key, uuid4().hex, timeout=None)
+
+
+def get_posts_cache_key(prefix, *parts):
+    """
+    Build a cache key which is invalidated whenever posts or categories change
+
+    :param prefix: cache entry type
+    :param parts: values identifying the cache entry (site, language, namespace, ...)
+    """
+    return 'djangocms-blog:{0}:{1}:{2}'.format(
+        prefix, get_cache_version(POSTS_VERSION_KEY), ':'.join(force_text(part) for part in parts)
+    )
+
+
+def invalidate_posts_cache():
+    """
+    Invalidate all the cache entries built with :py:func:`get_posts_cache_key`
+    """
+    bump_cache_version(POSTS_VERSION_KEY)
+
+
+def invalidate_app_config_cache(app_config_id):
+    """
+    Change the version of the cache entries depending on the posts of the given ``BlogConfig``
+    """
+    bump_cache_version(APP_CONFIG_VERSION_KEY.format(app_config_id))
+
+
+def acquire_cache_lock(key):
+    """
+    Lock the given cache entry, thus only one worker rebuilds it at a time
+
+    The lock expires after ``BLOG_CACHE_LOCK_TIMEOUT`` seconds in case its holder dies.
+
+    :return: ``False`` if the entry is already locked by another worker
+    """
+    return cache.add('{0}:lock'.format(key), True, timeout=get_setting('CACHE_LOCK_TIMEOUT'))
+
+
+def release_cache_lock(key):
+    """
+    Unlock the given cache entry
+    """
+    cache.delete('{0}:lock'.format(key))
+
+
+def _wait_for_value(key):
+    """
+    Wait up to ``BLOG_CACHE_LOCK_WAIT`` seconds for another worker to store the given entry
+
+    :return: cached entry or ``None``
+    """
+    deadline = time.time() + get_setting('CACHE_LOCK_WAIT')
+    while time.time() < deadline:
+        time.sleep(0.05)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+
+def get_or_rebuild(key, version, build, timeout=None):
+    """
+    Return the value cached under the given key, building it if missing.
+
+    Only the worker locking the entry builds it: if a value built for a different version
+    (stale) is available, the other workers keep getting it until the fresh one is stored,
+    otherwise they wait for the fresh value up to ``BLOG_CACHE_LOCK_WAIT`` seconds and then
+    build it on their own without storing it.
+
+    :param key: cache key (not including the version)
+    :param version: current version of the value
+    :param build: callable returning the fresh value
+    :param timeout: cache timeout
+    :return: tuple of value and stale flag
+    """
+    cached = cache.get(key)
+    if cached is not None and cached['version'] == version:
+        return cached['value'], False
+    if not acquire_cache_lock(key):
+        if cached is None:
+            cached = _wait_for_value(key)
+        if cached is not None:
+            return cached['value'], cached['version'] != version
+        return build(), False
+    try:
+        value = build()
+        cache.set(key, {'version': version, 'value': value}, timeout=timeout)
+    finally:
+        release_cache_lock(key)
+    return value, False
+
+
+def set_stale(key, value, timeout=None):
+    """
+    Cache the given value as stale, thus it's rebuilt by the next :py:func:`get_or_rebuild` call
+    """
+    cache.set(key, {'version': None, 'value': value}, timeout=timeout)
+
+
+def _get_tag_key(tag):
+    return 'djangocms-blog:tag:{0}:version'.format(tag)
+
+
+def set_tagged(key, value, tags, timeout=None):
+    """
+    Cache the given value tagged with the objects it depends on: the value is discarded as soon
+    as any of the tags is invalidated by :py:func:`invalidate_tags`
+
+    :param tags: list of tags (e.g.: ``post:1``)
+    """
+    tag_keys = [_get_tag_key(tag) for tag in set(tags)]
+    versions = cache.get_many(tag_keys)
+    for tag_key in tag_keys:
+        if tag_key not in versions:
+            versions[tag_key] = get_cache_version(tag_key)
+    cache.set(key, {'tags': versions, 'value': value}, timeout=timeout)
+
+
+def get_tagged(key):
+    """
+    Return the value cached by :py:func:`set_tagged`, or ``None`` if missing or if any of its
+    tags has been invalidated
+    """
+    cached = cache.get(key)
+    if cached is None:
+        return
+    versions = cache.get_many(list(cached['tags']))
+    if any(versions.get(tag_key) != version for tag_key, version in cached['tags'].items()):
+        return
+    return cached['value']
+
+
+def invalidate_tags(tags):
+    """
+    Invalidate all the values cached by :py:func:`set_tagged` with any of the given tags
+    """
+    cache.set_many(
+        dict((_get_tag_key(tag), uuid4().hex) for tag in set(tags)), timeout=None
+    )
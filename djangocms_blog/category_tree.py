@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function, unicode_literals
+
+from django.core.urlresolvers import reverse
+from django.utils.http import urlquote
+from parler.utils.i18n import get_active_language_choices
+
+from .caching import bump_cache_version, get_cache_version
+from .models import BlogCategory
+
+CATEGORY_TREE_VERSION_KEY = 'djangocms-blog:category-tree:version'
+
+_trees = {}
+
+
+class CategoryNode(object):
+    """
+    Snapshot of a single category: primary key, parent and translated name / slug
+    """
+
+    def __init__(self, tree, pk, parent_id):
+        self.tree = tree
+        self.pk = pk
+        self.parent_id = parent_id
+        self.names = {}
+        self.slugs = {}
+        self.children = []
+
+    def _get_translated(self, values, language):
+        for lang in get_active_language_choices(language):
+            if values.get(lang):
+                return values[lang]
+        return ''
+
+    def has_translation(self, language):
+        return any(lang in self.names for lang in get_active_language_choices(language))
+
+    def get_name(self, language):
+        return self._get_translated(self.names, language)
+
+    def get_slug(self, language):
+        return self._get_translated(self.slugs, language)
+
+    def get_absolute_url(self, language):
+        """
+        Same as :py:meth:`BlogCategory.get_absolute_url` without touching the database
+        """
+        namespace = self.tree.namespace
+        if language in self.names:
+            return reverse(
+                '%s:posts-category' % namespace,
+                kwargs={'category': self.slugs[language]}, current_app=namespace
+            )
+        return reverse('%s:posts-latest' % namespace, current_app=namespace)
+
+
+class CategoryTree(object):
+    """
+    In-memory snapshot of all the categories of a blog namespace
+    """
+
+    def __init__(self, namespace):
+        self.namespace = namespace
+        self.nodes = {}
+        self._slugs = {}
+        self._descendants = {}
+        categories = BlogCategory.objects.namespace(namespace).values_list('pk', 'parent_id')
+        for pk, parent_id in categories:
+            self.nodes[pk] = CategoryNode(self, pk, parent_id)
+        translations = BlogCategory._parler_meta.root_model.objects.filter(
+            master__app_config__namespace=namespace
+        ).values_list('master_id', 'language_code', 'name', 'slug')
+        for master_id, language, name, slug in translations:
+            self.nodes[master_id].names[language] = name
+            self.nodes[master_id].slugs[language] = slug
+            self._slugs[language, slug] = self.nodes[master_id]
+        for node in self.nodes.values():
+            if node.parent_id in self.nodes:
+                self.nodes[node.parent_id].children.append(node.pk)
+
+    def get(self, pk):
+        return self.nodes.get(pk)
+
+    def get_by_slug(self, slug, language):
+        """
+        Return the category having the given slug in the given language (or its fallbacks)
+        """
+        for lang in get_active_language_choices(language):
+            if (lang, slug) in self._slugs:
+                return self._slugs[lang, slug]
+
+    def get_descendant_ids(self, pk):
+        """
+        Return the set of the primary keys of all the descendants of the given category
+        """
+        if pk not in self._descendants:
+            descendants = set()
+            children = list(self.nodes[pk].children) if pk in self.nodes else []
+            while children:
+                child = children.pop()
+                if child not in descendants:
+                    descendants.add(child)
+                    children.extend(self.nodes[child].children)
+            self._descendants[pk] = descendants
+        return self._descendants[pk]
+
+    def get_absolute_urls(self, nodes, language):
+        """
+        Return the URLs of the given categories reversing a single URL instead of one per node
+
+        :return: list of URLs (in the same order of nodes)
+        """
+        marker = 'djangocms-blog-category'
+        category_url = reverse(
+            '%s:posts-category' % self.namespace,
+            kwargs={'category': marker}, current_app=self.namespace
+        )
+        prefix, __, suffix = category_url.partition(marker)
+        latest_url = None
+        urls = []
+        for node in nodes:
+            if language in node.names:
+                urls.append(prefix + urlquote(node.slugs[language]) + suffix)
+            else:
+                if latest_url is None:
+                    latest_url = node.get_absolute_url(language)
+                urls.append(latest_url)
+        return urls
+
+    def get_translated_nodes(self, language):
+        """
+        Return the categories available in the given language (or its fallbacks),
+        ordered by parent and name
+        """
+        nodes = [node for node in self.nodes.values() if node.has_translation(language)]
+        return sorted(nodes, key=lambda node: (node.parent_id or 0, node.get_name(language)))
+
+
+def get_category_tree(namespace):
+    """
+    Return the category tree snapshot of the given namespace.
+
+    The snapshot is kept in process memory and it's lazily rebuilt whenever the version
+    counter stored in the django cache changes, thus allowing to invalidate the snapshot
+    across all the workers.
+    """
+    version = get_cache_version(CATEGORY_TREE_VERSION_KEY)
+    cached = _trees.get(namespace)
+    if cached and cached[0] == version:
+        return cached[1]
+    tree = CategoryTree(namespace)
+    _trees[namespace] = (version, tree)
+    return tree
+
+
+def invalidate_category_tree():
+    """
+    Bump the category tree version, forcing all the workers to rebuild their snapshots
+    """
+    bump_cache_version(CATEGORY_TREE_VERSION_KEY)
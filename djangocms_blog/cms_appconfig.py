@@ -57,6 +57,17 @@ class BlogConfigForm(AppDataForm):
         label=_('Paginate size'), required=False, initial=get_setting('PAGINATION'),
         help_text=_('When paginating list views, how many articles per page?')
     )
+    pagination_mode = forms.ChoiceField(
+        label=_('Pagination'), required=False,
+        choices=get_setting('PAGINATION_MODES'), initial=get_setting('PAGINATION_MODE'),
+        help_text=_('Cursors avoid slow deep pages on large blogs, but pages are not numbered '
+                    'in the URLs')
+    )
+    pagination_count = forms.ChoiceField(
+        label=_('Pagination count'), required=False,
+        choices=get_setting('PAGINATION_COUNTS'), initial=get_setting('PAGINATION_COUNT'),
+        help_text=_('How the total number of pages is computed when using cursors')
+    )
     template_prefix = forms.CharField(
         label=_('Template prefix'), required=False, initial='',
         help_text=_('Alternative directory to load the blog templates from')
@@ -71,6 +82,22 @@ class BlogConfigForm(AppDataForm):
         required=False,
         help_text=_('Show categories with no post attached in the menu')
     )
+    menu_posts_limit = forms.IntegerField(
+        label=_('Posts in menu'), required=False, min_value=0,
+        initial=get_setting('MENU_POSTS_LIMIT'),
+        help_text=_('Maximum number of posts in the menu, latest first (0 for no limit)')
+    )
+    menu_posts_per_category = forms.IntegerField(
+        label=_('Posts per category in menu'), required=False, min_value=0,
+        initial=get_setting('MENU_POSTS_PER_CATEGORY'),
+        help_text=_('Maximum number of posts for each category in the menu, latest first '
+                    '(0 for no limit)')
+    )
+    menu_posts_current_year = forms.BooleanField(
+        label=_('Only current year posts in menu'), required=False,
+        initial=get_setting('MENU_POSTS_CURRENT_YEAR'),
+        help_text=_('Only add to the menu the posts published in the current year')
+    )
     sitemap_changefreq = forms.ChoiceField(
         label=_('Sitemap changefreq'), required=True,
         choices=get_setting('SITEMAP_CHANGEFREQ'),
@@ -1,15 +1,23 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, print_function, unicode_literals
 
+from collections import Counter
+from datetime import datetime
+
 from cms.apphook_pool import apphook_pool
 from cms.menu_bases import CMSAttachMenu
+from cms.models import Page
+from django.conf import settings
 from django.contrib.sites.shortcuts import get_current_site
+from django.core.exceptions import ObjectDoesNotExist
 from django.core.urlresolvers import resolve
-from django.db.models.signals import post_delete, post_save
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.utils.timezone import localtime, make_aware, now
 from django.utils.translation import get_language_from_request, ugettext_lazy as _
 from menus.base import Modifier, NavigationNode
 from menus.menu_pool import menu_pool
 
+from .category_tree import get_category_tree, invalidate_category_tree
 from .cms_appconfig import BlogConfig
 from .models import BlogCategory, Post
 from .settings import MENU_TYPE_CATEGORIES, MENU_TYPE_COMPLETE, MENU_TYPE_POSTS, get_setting
@@ -48,50 +56,71 @@ class BlogCategoryMenu(CMSAttachMenu):
         if config and config.menu_structure in (MENU_TYPE_COMPLETE, MENU_TYPE_POSTS):
             posts_menu = True
 
-        used_categories = []
+        posts = Post.objects.published(current_site=False)
+        if hasattr(self, 'instance') and self.instance:
+            posts = posts.namespace(self.instance.application_namespace).on_site()
+        posts = posts.active_translations(language).distinct()
+
+        used_categories = set()
+        if categories_menu and not config.menu_empty_categories:
+            used_categories.update(
+                posts.order_by().values_list('categories', flat=True).distinct()
+            )
+
         if posts_menu:
-            posts = Post.objects
-            if hasattr(self, 'instance') and self.instance:
-                posts = posts.namespace(self.instance.application_namespace).on_site()
-            posts = posts.active_translations(language).distinct()
-            for post in posts:
-                post_id = None
-                parent = None
-                used_categories.extend(post.categories.values_list('pk', flat=True))
-                if categories_menu:
-                    category = post.categories.first()
-                    if category:
-                        parent = '{0}-{1}'.format(category.__class__.__name__, category.pk)
-                        post_id = '{0}-{1}'.format(post.__class__.__name__, post.pk),
-                else:
-                    post_id = '{0}-{1}'.format(post.__class__.__name__, post.pk),
-                if post_id:
-                    node = NavigationNode(
-                        post.get_title(),
-                        post.get_absolute_url(language),
-                        post_id,
-                        parent
+            if config.menu_posts_current_year:
+                year = localtime(now()).year if settings.USE_TZ else now().year
+                start = datetime(year, 1, 1)
+                if settings.USE_TZ:
+                    start = make_aware(start)
+                # a range on the date (unlike __year) can use the index on the field
+                posts = posts.filter(
+                    date_published__gte=start, date_published__lt=start.replace(year=year + 1)
+                )
+            if config.menu_posts_limit:
+                posts = posts[:config.menu_posts_limit]
+            posts = list(posts.select_related('app_config').prefetch_related(
+                'translations', 'categories', 'categories__translations'
+            ))
+            urls = Post.get_absolute_urls(posts, language)
+            category_posts = Counter()
+            for post, url in zip(posts, urls):
+                categories = post.categories.all()
+                category = min(categories, key=lambda item: item.pk) if categories else None
+                if categories_menu and not category:
+                    continue
+                if config.menu_posts_per_category:
+                    category_id = category.pk if category else None
+                    if category_posts[category_id] >= config.menu_posts_per_category:
+                        continue
+                    category_posts[category_id] += 1
+                node = NavigationNode(
+                    post.get_title(),
+                    url,
+                    '{0}-{1}'.format(Post.__name__, post.pk),
+                    (
+                        '{0}-{1}'.format(
+                            BlogCategory.__name__, category.pk
+                        ) if categories_menu else None
                     )
-                    nodes.append(node)
+                )
+                nodes.append(node)
 
         if categories_menu:
-            categories = BlogCategory.objects
-            if config:
-                categories = categories.namespace(self.instance.application_namespace)
-            if config and not config.menu_empty_categories:
-                categories = categories.filter(pk__in=used_categories)
-            else:
-                categories = categories.active_translations(language).distinct()
-            categories = categories.order_by('parent__id', 'translations__name')
-            for category in categories:
+            tree = get_category_tree(self.instance.application_namespace)
+            categories = tree.get_translated_nodes(language)
+            if not config.menu_empty_categories:
+                categories = [node for node in categories if node.pk in used_categories]
+            urls = tree.get_absolute_urls(categories, language)
+            for category, url in zip(categories, urls):
                 node = NavigationNode(
-                    category.name,
-                    category.get_absolute_url(),
-                    '{0}-{1}'.format(category.__class__.__name__, category.pk),
+                    category.get_name(language),
+                    url,
+                    '{0}-{1}'.format(BlogCategory.__name__, category.pk),
                     (
                         '{0}-{1}'.format(
-                            category.__class__.__name__, category.parent.id
-                        ) if category.parent else None
+                            BlogCategory.__name__, category.parent_id
+                        ) if category.parent_id else None
                     )
                 )
                 nodes.append(node)
@@ -118,14 +147,15 @@ class BlogNavModifier(Modifier):
         :param breadcrumb: flag for modifier stage
         :return: nodeslist
         """
-        app = None
-        config = None
-        if getattr(request, 'current_page', None) and request.current_page.application_urls:
-            app = apphook_pool.get_apphook(request.current_page.application_urls)
-
-        if app and app.app_config:
-            namespace = resolve(request.path).namespace
-            config = app.get_config(namespace)
+        if post_cut:
+            return nodes
+        current_post = getattr(request, get_setting('CURRENT_POST_IDENTIFIER'), None)
+        if not current_post or current_post.__class__ != Post:
+            return nodes
+        # blog views store the current config on the request: use it to skip resolving again
+        config = getattr(request, get_setting('CURRENT_NAMESPACE'), None)
+        if config is None:
+            config = self._get_config(request)
         try:
             if config and (
                     not isinstance(config, BlogConfig) or
@@ -135,28 +165,139 @@ class BlogNavModifier(Modifier):
         except AttributeError:  # pragma: no cover
             # in case `menu_structure` is not present in config
             return nodes
-        if post_cut:
-            return nodes
-        current_post = getattr(request, get_setting('CURRENT_POST_IDENTIFIER'), None)
-        category = None
-        if current_post and current_post.__class__ == Post:
-            category = current_post.categories.first()
-        if not category:
+        # categories are usually already prefetched by the view
+        categories = current_post.categories.all()
+        if not categories:
             return nodes
-
+        category = min(categories, key=lambda item: item.pk)
+        node_id = '{0}-{1}'.format(BlogCategory.__name__, category.pk)
+        # nodes may be changed in place by other modifiers: look them up on each call
         for node in nodes:
-            if '{0}-{1}'.format(category.__class__.__name__, category.pk) == node.id:
+            if node.id == node_id:
                 node.selected = True
+                break
         return nodes
 
+    def _get_config(self, request):
+        app = None
+        config = None
+        if getattr(request, 'current_page', None) and request.current_page.application_urls:
+            app = apphook_pool.get_apphook(request.current_page.application_urls)
+        if app and app.app_config:
+            namespace = resolve(request.path).namespace
+            config = app.get_config(namespace)
+        return config
+
 menu_pool.register_modifier(BlogNavModifier)
 
 
-def clear_menu_cache(**kwargs):
+# fields (and translated fields) whose changes affect the menu
+MENU_FIELDS = {
+    BlogCategory: ('app_config_id', 'parent_id'),
+    BlogCategory._parler_meta.root_model: ('name', 'slug'),
+    Post: ('app_config_id', 'publish', 'date_published', 'date_published_end'),
+    Post._parler_meta.root_model: ('title', 'slug'),
+}
+
+
+def clear_blog_menu_cache(namespaces):
+    """
+    Empty the menu cache of the sites where the given blog namespaces are attached to a page
+
+    Menus in all the languages are cleared, as posts and categories are also shown through
+    the language fallbacks.
+
+    :param namespaces: blog namespaces
+    """
+    namespaces = set(namespaces)
+    namespaces.discard(None)
+    if not namespaces:
+        return
+    site_ids = Page.objects.filter(
+        application_namespace__in=namespaces
+    ).order_by().values_list('site_id', flat=True).distinct()
+    for site_id in site_ids:
+        menu_pool.clear(site_id=site_id)
+
+
+def _get_namespace(app_config_id):
+    if app_config_id:
+        return BlogConfig.objects.filter(pk=app_config_id).values_list(
+            'namespace', flat=True
+        ).first()
+
+
+def _get_menu_scope(sender, instance):
+    """
+    Return the post / category and the ``BlogConfig`` pk of the menus affected by the given
+    instance (post, category or one of their translations)
+    """
+    if sender in (Post, BlogCategory):
+        return instance, instance.app_config_id
+    try:
+        master = instance.master
+    except ObjectDoesNotExist:  # pragma: no cover
+        # translations deleted together with the master object
+        return None, None
+    return master, master.app_config_id
+
+
+def pre_save_menu(sender, instance, raw=False, **kwargs):
+    if not raw and instance.pk:
+        instance._previous_menu_data = sender.objects.filter(
+            pk=instance.pk
+        ).values_list(*MENU_FIELDS[sender]).first()
+
+
+def post_save_menu(sender, instance, raw=False, created=False, **kwargs):
     """
-    Empty menu cache when saving categories
+    Empty the menu cache when data shown in the menu change
     """
-    menu_pool.clear(all=True)
+    if raw:
+        return
+    if sender in (BlogCategory, BlogCategory._parler_meta.root_model):
+        invalidate_category_tree()
+    previous = getattr(instance, '_previous_menu_data', None)
+    current = tuple(getattr(instance, field) for field in MENU_FIELDS[sender])
+    if previous == current:
+        return
+    obj, app_config_id = _get_menu_scope(sender, instance)
+    if not obj or (created and not getattr(obj, 'publish', True)):
+        return
+    app_config_ids = set([app_config_id])
+    if sender in (Post, BlogCategory) and previous:
+        app_config_ids.add(previous[0])
+    clear_blog_menu_cache([_get_namespace(pk) for pk in app_config_ids])
+
+
+def post_delete_menu(sender, instance, **kwargs):
+    if sender in (BlogCategory, BlogCategory._parler_meta.root_model):
+        invalidate_category_tree()
+    obj, app_config_id = _get_menu_scope(sender, instance)
+    if obj:
+        clear_blog_menu_cache([_get_namespace(app_config_id)])
+
+
+def m2m_post_menu(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Empty the menu cache when post categories or sites change
+    """
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        namespaces = [_get_namespace(instance.app_config_id)]
+    elif pk_set:
+        namespaces = Post.objects.filter(pk__in=pk_set).values_list(
+            'app_config__namespace', flat=True
+        ).distinct()
+    else:
+        namespaces = BlogConfig.objects.values_list('namespace', flat=True)
+    clear_blog_menu_cache(namespaces)
+
 
-post_save.connect(clear_menu_cache, sender=BlogCategory)
-post_delete.connect(clear_menu_cache, sender=BlogCategory)
+for model in MENU_FIELDS:
+    pre_save.connect(pre_save_menu, sender=model)
+    post_save.connect(post_save_menu, sender=model)
+    post_delete.connect(post_delete_menu, sender=model)
+m2m_changed.connect(m2m_post_menu, sender=Post.categories.through)
+m2m_changed.connect(m2m_post_menu, sender=Post.sites.through)
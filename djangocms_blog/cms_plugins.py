@@ -6,10 +6,15 @@ import os.path
 from cms.plugin_base import CMSPluginBase
 from cms.plugin_pool import plugin_pool
 from django.contrib.sites.shortcuts import get_current_site
+from django.core.cache import cache
 from django.db import models
+from django.utils.translation import get_language
 
+from .caching import get_posts_cache_key
 from .forms import LatestEntriesForm
-from .models import AuthorEntriesPlugin, BlogCategory, GenericBlogPlugin, LatestPostsPlugin, Post
+from .models import (
+    AuthorEntriesPlugin, BlogCategory, GenericBlogPlugin, LatestPostsPlugin, Post, PostCount,
+)
 from .settings import get_setting
 
 
@@ -77,7 +82,7 @@ class BlogAuthorPostsPlugin(BlogPlugin):
 
     def render(self, context, instance, placeholder):
         context = super(BlogAuthorPostsPlugin, self).render(context, instance, placeholder)
-        context['authors_list'] = instance.get_authors()
+        context['authors_list'] = instance.get_authors(cached=True)
         return context
 
 
@@ -88,10 +93,24 @@ class BlogTagsPlugin(BlogPlugin):
     base_render_template = 'tags.html'
     exclude = ['template_folder'] if len(get_setting('PLUGIN_TEMPLATE_FOLDERS')) >= 1 else []
 
+    def get_tags(self, instance, request):
+        """
+        Return the tag cloud, cached per site, language and namespace
+        """
+        key = get_posts_cache_key(
+            'tags-plugin', get_current_site(request).pk, get_language(),
+            instance.app_config_id or '', instance.current_site
+        )
+        tags = cache.get(key)
+        if tags is None:
+            qs = instance.post_queryset(request)
+            tags = Post.objects.tag_cloud(queryset=qs.published())
+            cache.set(key, tags, timeout=get_setting('PLUGIN_CACHE_TIMEOUT'))
+        return tags
+
     def render(self, context, instance, placeholder):
         context = super(BlogTagsPlugin, self).render(context, instance, placeholder)
-        qs = instance.post_queryset(context['request'])
-        context['tags'] = Post.objects.tag_cloud(queryset=qs.published())
+        context['tags'] = self.get_tags(instance, context['request'])
         return context
 
 
@@ -102,17 +121,37 @@ class BlogCategoryPlugin(BlogPlugin):
     base_render_template = 'categories.html'
     exclude = ['template_folder'] if len(get_setting('PLUGIN_TEMPLATE_FOLDERS')) >= 1 else []
 
+    def get_categories(self, instance, request):
+        """
+        Return the categories list annotated with the published posts count.
+
+        The list is cached per site, language and namespace and it's invalidated whenever
+        posts or categories change.
+        """
+        site = get_current_site(request)
+        language = get_language()
+        key = get_posts_cache_key(
+            'category-plugin', site.pk, language, instance.app_config_id or '',
+            instance.current_site
+        )
+        categories = cache.get(key)
+        if categories is None:
+            qs = BlogCategory.objects.language(language).active_translations(language)
+            if instance.app_config:
+                qs = qs.namespace(instance.app_config.namespace)
+            if instance.current_site:
+                qs = qs.filter(
+                    models.Q(blog_posts__sites__isnull=True) | models.Q(blog_posts__sites=site.pk)
+                )
+            categories = PostCount.objects.attach_counts(
+                qs.distinct(), PostCount.CATEGORY, app_config=instance.app_config_id, site=site
+            )
+            cache.set(key, categories, timeout=get_setting('PLUGIN_CACHE_TIMEOUT'))
+        return categories
+
     def render(self, context, instance, placeholder):
         context = super(BlogCategoryPlugin, self).render(context, instance, placeholder)
-        qs = BlogCategory.objects.language().active_translations()
-        if instance.app_config:
-            qs = qs.namespace(instance.app_config.namespace)
-        if instance.current_site:
-            site = get_current_site(context['request'])
-            qs = qs.filter(
-                models.Q(blog_posts__sites__isnull=True) | models.Q(blog_posts__sites=site.pk)
-            )
-        context['categories'] = qs.distinct()
+        context['categories'] = self.get_categories(instance, context['request'])
         return context
 
 
@@ -123,10 +162,24 @@ class BlogArchivePlugin(BlogPlugin):
     base_render_template = 'archive.html'
     exclude = ['template_folder'] if len(get_setting('PLUGIN_TEMPLATE_FOLDERS')) >= 1 else []
 
+    def get_months(self, instance, request):
+        """
+        Return the archive months, cached per site, language and namespace
+        """
+        key = get_posts_cache_key(
+            'archive-plugin', get_current_site(request).pk, get_language(),
+            instance.app_config_id or '', instance.current_site
+        )
+        months = cache.get(key)
+        if months is None:
+            qs = instance.post_queryset(request)
+            months = Post.objects.get_months(queryset=qs.published())
+            cache.set(key, months, timeout=get_setting('PLUGIN_CACHE_TIMEOUT'))
+        return months
+
     def render(self, context, instance, placeholder):
         context = super(BlogArchivePlugin, self).render(context, instance, placeholder)
-        qs = instance.post_queryset(context['request'])
-        context['dates'] = Post.objects.get_months(queryset=qs.published())
+        context['dates'] = self.get_months(instance, context['request'])
         return context
 
 
@@ -1,24 +1,37 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, print_function, unicode_literals
 
+import hashlib
+from importlib import import_module
+
 from aldryn_apphooks_config.utils import get_app_instance
+from cms.models import Page
+from cms.utils import get_language_list
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
 from django.contrib.sites.models import Site
+from django.contrib.sites.shortcuts import get_current_site
 from django.contrib.syndication.views import Feed
-from django.core.cache import cache
 from django.core.urlresolvers import reverse
+from django.http import Http404, HttpRequest, HttpResponse, HttpResponseNotModified
 from django.utils.encoding import force_text
 from django.utils.feedgenerator import Rss201rev2Feed
 from django.utils.html import strip_tags
+from django.utils.http import parse_etags, parse_http_date_safe, quote_etag
 from django.utils.safestring import mark_safe
-from django.utils.six import BytesIO
 from django.utils.text import normalize_newlines
-from django.utils.translation import get_language_from_request, ugettext as _
-from lxml import etree
+from django.utils.translation import get_language_from_request, override, ugettext as _
+from parler.utils.context import switch_language
 
 from djangocms_blog.settings import get_setting
 from djangocms_blog.views import PostDetailView
 
-from .models import Post
+from .caching import (
+    APP_CONFIG_VERSION_KEY, POSTS_VERSION_KEY, acquire_cache_lock, get_cache_version,
+    get_or_rebuild, release_cache_lock, set_stale,
+)
+from .instant_articles import clean_instant_article
+from .models import InstantArticle, Post
 
 try:
     import HTMLParser
@@ -37,21 +50,81 @@ class LatestEntriesFeed(Feed):
     def __call__(self, request, *args, **kwargs):
         self.request = request
         self.namespace, self.config = get_app_instance(request)
-        return super(LatestEntriesFeed, self).__call__(request, *args, **kwargs)
+        self.site = get_current_site(request)
+        self.stale_parts = False
+        key = self.get_cache_key(request, *args, **kwargs)
+        timeout = get_setting('FEED_CACHE_TIMEOUT')
+        cached, stale = get_or_rebuild(
+            key, self.get_cache_version(), lambda: self._render(request, *args, **kwargs), timeout
+        )
+        if self.stale_parts:
+            # built using stale parts: store it as stale to have it rebuilt on next request
+            set_stale(key, cached, timeout)
+            stale = True
+        if self._is_not_modified(request, cached):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(cached['content'], content_type=cached['content_type'])
+        response['ETag'] = quote_etag(cached['etag'])
+        if cached['last_modified']:
+            response['Last-Modified'] = cached['last_modified']
+        if stale:
+            response['Warning'] = '110 - "Response is Stale"'
+        return response
+
+    def _render(self, request, *args, **kwargs):
+        response = super(LatestEntriesFeed, self).__call__(request, *args, **kwargs)
+        return {
+            'content': response.content,
+            'content_type': response['Content-Type'],
+            'last_modified': response.get('Last-Modified'),
+            'etag': hashlib.md5(response.content).hexdigest(),
+        }
+
+    def get_cache_key(self, request, *args, **kwargs):
+        """
+        Cache key of the rendered feed
+        """
+        language = get_language_from_request(request, check_path=True)
+        parts = list(args) + [kwargs[key] for key in sorted(kwargs)]
+        return 'djangocms-blog:feed:{0}:{1}:{2}:{3}:{4}'.format(
+            self.__class__.__name__, getattr(self.config, 'pk', ''), language, self.site.pk,
+            ':'.join(force_text(part) for part in parts)
+        )
+
+    def get_cache_version(self):
+        """
+        Version of the rendered feed: it changes whenever a post of the current blog changes,
+        making the cached feed stale
+        """
+        return get_cache_version(APP_CONFIG_VERSION_KEY.format(getattr(self.config, 'pk', '')))
+
+    def _is_not_modified(self, request, cached):
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match:
+            return cached['etag'] in parse_etags(if_none_match) or if_none_match == '*'
+        if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+        last_modified = parse_http_date_safe(cached['last_modified'] or '')
+        return bool(if_modified_since and last_modified and last_modified <= if_modified_since)
 
     def link(self):
         return reverse('%s:posts-latest' % self.namespace, current_app=self.namespace)
 
     def title(self):
-        return Site.objects.get_current().name
+        return self.site.name
 
     def description(self):
-        return _('Blog articles on %(site_name)s') % {'site_name': Site.objects.get_current().name}
+        return _('Blog articles on %(site_name)s') % {'site_name': self.site.name}
+
+    def _prepare_items(self, queryset):
+        items = list(queryset)
+        Post.get_absolute_urls(items)
+        return items
 
     def items(self, obj=None):
-        return Post.objects.namespace(
+        return self._prepare_items(Post.objects.namespace(
             self.namespace
-        ).published().order_by('-date_published')[:self.feed_items_number]
+        ).published().list_ready().order_by('-date_published')[:self.feed_items_number])
 
     def item_title(self, item):
         return mark_safe(item.safe_translation_getter('title'))
@@ -83,8 +156,17 @@ class TagFeed(LatestEntriesFeed):
     def get_object(self, request, tag):
         return tag  # pragma: no cover
 
+    def get_cache_version(self):
+        """
+        Tagged posts are not limited to the current blog: cached feed is stale whenever any
+        post changes
+        """
+        return get_cache_version(POSTS_VERSION_KEY)
+
     def items(self, obj=None):
-        return Post.objects.published().filter(tags__slug=obj)[:self.feed_items_number]
+        return self._prepare_items(Post.objects.published().filter(
+            tags__slug=obj
+        ).list_ready()[:self.feed_items_number])
 
 
 class FBInstantFeed(Rss201rev2Feed):
@@ -139,32 +221,62 @@ class FBInstantArticles(LatestEntriesFeed):
     feed_items_number = get_setting('FEED_INSTANT_ITEMS')
 
     def items(self, obj=None):
-        return Post.objects.namespace(
+        self._items = self._prepare_items(Post.objects.namespace(
             self.namespace
-        ).published().order_by('-date_modified')[:self.feed_items_number]
-
-    def _clean_html(self, content):
-        body = BytesIO(content)
-        document = etree.iterparse(body, html=True)
-        for a, e in document:
-            if not (e.text and e.text.strip()) and len(e) == 0 and e.tag == 'p':
-                e.getparent().remove(e)
-            if e.tag in ('h3', 'h4', 'h5', 'h6') and 'op-kicker' not in e.attrib.get('class', ''):
-                e.tag = 'h2'
-        return etree.tostring(document.root)
+        ).published().list_ready().order_by('-date_modified')[:self.feed_items_number])
+        self._contents = None
+        return self._items
+
+    def _clean_html(self, content, encoding='utf-8'):
+        """
+        Remove empty paragraphs and convert h3 - h6 headings (except kickers) to h2 in the
+        ``blog-content`` element of the rendered page.
+
+        The page is cleaned while it's parsed, without building its tree
+        (see :py:class:`djangocms_blog.instant_articles.InstantArticleCleaner`).
+        """
+        return clean_instant_article(content, encoding)
+
+    def render_content(self, item, request):
+        """
+        Render the instant article body of the given post
+        """
+        view = PostDetailView.as_view(instant_article=True)
+        response = view(request, slug=item.safe_translation_getter('slug'))
+        response.render()
+        return self._clean_html(response.content, response.charset)
+
+    def get_content(self, item, language):
+        """
+        Return the stored body of the given post, rendering and storing it if missing.
+
+        Stale bodies (rendered before the last modification of the post or of its content
+        plugins) are rendered again by the first worker requesting them, while the others keep
+        using the stale ones.
+        Stored bodies of all the feed items are fetched with a single query.
+        """
+        if self._contents is None:
+            self._contents = InstantArticle.objects.get_stored(self._items, language)
+        content, fresh = self._contents.get(item.pk, (None, False))
+        if fresh:
+            return content
+        with switch_language(item, language):
+            key = item.get_cache_key(language, 'instant-article')
+        if content is not None and not acquire_cache_lock(key):
+            self.stale_parts = True
+            return content
+        try:
+            content = self.render_content(item, self.request)
+            InstantArticle.objects.store(item, language, content)
+        finally:
+            release_cache_lock(key)
+        return content
 
     def item_extra_kwargs(self, item):
         if not item:
             return {}
         language = get_language_from_request(self.request, check_path=True)
-        key = item.get_cache_key(language, 'feed')
-        content = cache.get(key)
-        if not content:
-            view = PostDetailView.as_view(instant_article=True)
-            response = view(self.request, slug=item.safe_translation_getter('slug'))
-            response.render()
-            content = self._clean_html(response.content)
-            cache.set(key, content, timeout=get_setting('FEED_CACHE_TIMEOUT'))
+        content = self.get_content(item, language)
         if item.app_config.use_abstract:
             abstract = strip_tags(item.safe_translation_getter('abstract'))
         else:
@@ -192,3 +304,76 @@ class FBInstantArticles(LatestEntriesFeed):
 
     def item_pubdate(self, item):
         return None
+
+
+def get_instant_article_request(post, language):
+    """
+    Build an anonymous request for the given post suitable to render its instant article
+    outside of the request / response cycle
+
+    :return: request, or ``None`` if the post blog is not attached to any page
+    """
+    site = Site.objects.get_current()
+    page = Page.objects.filter(
+        publisher_is_draft=False, site=site, application_namespace=post.app_config.namespace
+    ).first()
+    if not page:
+        return
+    request = HttpRequest()
+    request.method = 'GET'
+    request.path = request.path_info = post.get_absolute_url(language)
+    request.META['HTTP_HOST'] = site.domain
+    request.LANGUAGE_CODE = language
+    request.current_page = page
+    request.user = AnonymousUser()
+    request.session = import_module(settings.SESSION_ENGINE).SessionStore()
+    return request
+
+
+def prerender_instant_articles(posts=None, languages=None, force=False):
+    """
+    Render and store the instant article bodies of the given posts, thus the instant articles
+    feed doesn't have to render them on request.
+
+    :param posts: posts to render (default: all the published posts); unpublished posts are
+                  skipped
+    :param languages: languages to render (default: all the site languages)
+    :param force: render the bodies even if the stored ones are up to date
+    :return: list of (post, language) rendered
+    """
+    queryset = Post.objects.published(current_site=False).select_related('app_config')
+    if posts is not None:
+        queryset = queryset.filter(pk__in=[post.pk for post in posts])
+    posts = list(queryset)
+    languages = languages or get_language_list()
+    stored = set()
+    if not force:
+        for language in languages:
+            stored.update(
+                (post_id, language) for post_id in
+                InstantArticle.objects.get_contents(posts, language)
+            )
+    feed = FBInstantArticles()
+    rendered = []
+    for post in posts:
+        for language in post.get_available_languages():
+            if language not in languages or (post.pk, language) in stored:
+                continue
+            with switch_language(post, language):
+                key = post.get_cache_key(language, 'instant-article')
+            if not acquire_cache_lock(key):
+                # already being rendered by another worker
+                continue
+            try:
+                with override(language), switch_language(post, language):
+                    request = get_instant_article_request(post, language)
+                    if request is None:
+                        break
+                    content = feed.render_content(post, request)
+                InstantArticle.objects.store(post, language, content)
+                rendered.append((post, language))
+            except Http404:
+                continue
+            finally:
+                release_cache_lock(key)
+    return rendered
@@ -6,6 +6,7 @@ from django.conf import settings
 from parler.forms import TranslatableModelForm
 from taggit_autosuggest.widgets import TagAutoSuggest
 
+from .category_tree import get_category_tree
 from .models import BlogCategory, BlogConfig, Post
 
 
@@ -17,9 +18,12 @@ class CategoryAdminForm(TranslatableModelForm):
         if 'parent' in self.fields:
             qs = self.fields['parent'].queryset
             if self.instance.pk:
-                qs = qs.exclude(
-                    pk__in=[self.instance.pk] + [child.pk for child in self.instance.descendants()]
-                )
+                if getattr(self.instance, 'app_config_id', None):
+                    tree = get_category_tree(self.instance.app_config.namespace)
+                    descendants = list(tree.get_descendant_ids(self.instance.pk))
+                else:
+                    descendants = [child.pk for child in self.instance.descendants()]
+                qs = qs.exclude(pk__in=[self.instance.pk] + descendants)
 
             if getattr(self.instance, 'app_config_id', None):
                 qs = qs.namespace(self.instance.app_config.namespace)
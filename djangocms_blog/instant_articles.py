@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function, unicode_literals
+
+from io import StringIO
+
+from django.utils.six import text_type
+from lxml import etree
+
+VOID_TAGS = frozenset((
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen', 'link', 'meta', 'param',
+    'source', 'track', 'wbr',
+))
+RAW_TEXT_TAGS = frozenset(('script', 'style'))
+HEADING_TAGS = frozenset(('h3', 'h4', 'h5', 'h6'))
+CONTENT_CLASS = 'blog-content'
+
+
+def _escape_text(text):
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+def _escape_attribute(value):
+    return _escape_text(value).replace('"', '&quot;')
+
+
+class InstantArticleCleaner(object):
+    """
+    lxml parser target writing the page out while it's parsed, without building the document
+    tree: in the ``blog-content`` element empty paragraphs are removed and h3 - h6 headings
+    (except kickers) are converted to h2.
+
+    Only the output of the paragraph being parsed may be discarded, thus the page is visited
+    once and a single copy of it is held in memory.
+    """
+
+    def __init__(self):
+        self.output = StringIO()
+        # open elements: (written tag, inside the article body, frame of the paragraphs)
+        self.stack = []
+        self.raw_text = False
+
+    def _in_content(self):
+        return bool(self.stack) and self.stack[-1][1]
+
+    def _set_kept(self):
+        """
+        Mark the innermost open paragraph (if any) as not empty
+        """
+        if self.stack and self.stack[-1][2] is not None:
+            self.stack[-1][2]['kept'] = True
+
+    def start(self, tag, attrib):
+        in_content = self._in_content()
+        classes = attrib.get('class', '')
+        if in_content and tag in HEADING_TAGS and 'op-kicker' not in classes:
+            tag = 'h2'
+        paragraph = None
+        if in_content and tag == 'p':
+            paragraph = {'start': self.output.tell(), 'kept': False}
+        if tag == 'div' and CONTENT_CLASS in classes.split():
+            in_content = True
+        self.output.write('<{0}{1}>'.format(tag, ''.join(
+            ' {0}="{1}"'.format(name, _escape_attribute(value)) for name, value in attrib.items()
+        )))
+        self.stack.append((tag, in_content, paragraph))
+        self.raw_text = tag in RAW_TEXT_TAGS
+
+    def end(self, tag):
+        # a child element keeps the paragraph only if it's kept itself
+        tag, in_content, paragraph = self.stack.pop()
+        self.raw_text = False
+        if paragraph is not None and not paragraph['kept']:
+            # the text that follows the paragraph is kept, as it belongs to the parent
+            self.output.seek(paragraph['start'])
+            self.output.truncate()
+            return
+        if tag not in VOID_TAGS:
+            self.output.write('</{0}>'.format(tag))
+        self._set_kept()
+
+    def data(self, data):
+        if not self.stack:
+            return
+        if data.strip():
+            self._set_kept()
+        data = text_type(data)
+        self.output.write(data if self.raw_text else _escape_text(data))
+
+    def comment(self, text):
+        if self.stack:
+            self._set_kept()
+            self.output.write('<!--{0}-->'.format(text))
+
+    def close(self):
+        output = self.output.getvalue()
+        self.output.close()
+        return output
+
+
+def clean_instant_article(content, encoding='utf-8'):
+    """
+    Clean the article body of the given rendered page (see :py:class:`InstantArticleCleaner`)
+
+    :return: the page root element serialized as HTML
+    """
+    if not content or not content.strip():
+        return ''
+    parser = etree.HTMLParser(target=InstantArticleCleaner(), encoding=encoding)
+    parser.feed(content)
+    return parser.close()
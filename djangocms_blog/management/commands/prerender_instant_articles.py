@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function, unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from djangocms_blog.feeds import prerender_instant_articles
+
+
+class Command(BaseCommand):
+    help = 'Render and store the instant articles bodies of the published posts, skipping the ' \
+           'ones stored after the last post modification.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force', action='store_true', dest='force', default=False,
+            help='Render all the instant articles bodies'
+        )
+
+    def handle(self, *args, **options):
+        rendered = prerender_instant_articles(force=options['force'])
+        self.stdout.write('Rendered {0} instant articles'.format(len(rendered)))
@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function, unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from djangocms_blog.models import PostCount
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the published posts counters of categories, tags and authors. ' \
+           'Run it periodically to take into account scheduled publishing / expiration dates.'
+
+    def handle(self, *args, **options):
+        PostCount.objects.rebuild()
+        self.stdout.write('Rebuilt {0} counters'.format(PostCount.objects.count()))
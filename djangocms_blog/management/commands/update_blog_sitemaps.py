@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function, unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from djangocms_blog.sitemaps.shards import update_sitemap_shards
+
+
+class Command(BaseCommand):
+    help = 'Write the blog sitemaps to static files, regenerating only the ones whose ' \
+           'posts changed since the last run.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force', action='store_true', dest='force', default=False,
+            help='Regenerate all the sitemap files'
+        )
+        parser.add_argument(
+            '--protocol', dest='protocol', default='http', help='Protocol of the sitemap URLs'
+        )
+
+    def handle(self, *args, **options):
+        updated = update_sitemap_shards(force=options['force'], protocol=options['protocol'])
+        self.stdout.write('Updated {0} sitemap files'.format(len(updated)))
@@ -6,10 +6,17 @@ from collections import Counter
 from aldryn_apphooks_config.managers.parler import (
     AppHookConfigTranslatableManager, AppHookConfigTranslatableQueryset,
 )
+from django.conf import settings
 from django.contrib.sites.models import Site
-from django.db import models
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models.expressions import DateTime
+from django.utils import timezone
 from django.utils.timezone import now
 
+from .caching import get_posts_cache_key
+from .settings import get_setting
+
 
 class TaggedFilterItem(object):
 
@@ -23,26 +30,31 @@ class TaggedFilterItem(object):
 
     def _taglist(self, other_model=None, queryset=None):
         """
-        Restituisce una lista di id di tag comuni al model corrente e al model
+        Restituisce una queryset di id di tag comuni al model corrente e al model
         o queryset passati come argomento
         """
+        from django.contrib.contenttypes.models import ContentType
         from taggit.models import TaggedItem
         filter = None
         if queryset is not None:
-            filter = set()
-            for item in queryset.all():
-                filter.update(item.tags.all())
-            filter = set([tag.id for tag in filter])
+            if queryset.query.can_filter():
+                object_ids = queryset.order_by().values('pk')
+            else:
+                object_ids = list(queryset.values_list('pk', flat=True))
+            filter = TaggedItem.objects.filter(
+                content_type=ContentType.objects.get_for_model(queryset.model),
+                object_id__in=object_ids
+            )
         elif other_model is not None:
-            filter = set(TaggedItem.objects.filter(
-                content_type__model=other_model.__name__.lower()
-            ).values_list('tag_id', flat=True))
-        tags = set(TaggedItem.objects.filter(
-            content_type__model=self.model.__name__.lower()
-        ).values_list('tag_id', flat=True))
+            filter = TaggedItem.objects.filter(
+                content_type=ContentType.objects.get_for_model(other_model)
+            )
+        tags = TaggedItem.objects.filter(
+            content_type=ContentType.objects.get_for_model(self.model)
+        )
         if filter is not None:
-            tags = tags.intersection(filter)
-        return list(tags)
+            tags = tags.filter(tag_id__in=filter.values('tag_id'))
+        return tags.values('tag_id')
 
     def tag_list(self, other_model=None, queryset=None):
         """
@@ -56,24 +68,42 @@ class TaggedFilterItem(object):
         queryset = self.tag_list(other_model, queryset)
         return queryset.values('slug')
 
-    def tag_cloud(self, other_model=None, queryset=None, published=True, on_site=False):
+    def tag_cloud(self, other_model=None, queryset=None, published=True, on_site=False,
+                  limit=None):
+        """
+        Return the tags common to the current model and the given model or queryset,
+        annotated with the number of tagged items (``count``) and sorted by count
+
+        Only the items of the given queryset (if it's a queryset of the current model) are
+        counted.
+
+        :param limit: return only the ``limit`` most used tags
+        """
         from taggit.models import TaggedItem
+        if queryset is not None and not queryset.query.can_filter():
+            # sliced querysets can't be filtered or reordered
+            queryset = queryset.model._default_manager.filter(
+                pk__in=list(queryset.values_list('pk', flat=True))
+            )
         if on_site:
             queryset = queryset.on_site()
-        tag_ids = self._taglist(other_model, queryset)
-        kwargs = {}
+        items = TaggedItem._meta.get_field('tag').related_query_name()
+        kwargs = {'pk__in': self._taglist(other_model, queryset)}
+        counted = None
+        if queryset is not None and queryset.model is self.model:
+            counted = queryset
         if published:
-            kwargs = TaggedItem.bulk_lookup_kwargs(self.model.objects.published())
-        kwargs['tag_id__in'] = tag_ids
-        counted_tags = dict(TaggedItem.objects
-                                      .filter(**kwargs)
-                                      .values('tag')
-                                      .annotate(count=models.Count('tag'))
-                                      .values_list('tag', 'count'))
-        tags = TaggedItem.tag_model().objects.filter(pk__in=counted_tags.keys())
-        for tag in tags:
-            tag.count = counted_tags[tag.pk]
-        return sorted(tags, key=lambda x: -x.count)
+            counted = (counted if counted is not None else self.model.objects).published()
+        if counted is not None:
+            lookup = TaggedItem.bulk_lookup_kwargs(counted.order_by().values('pk'))
+            for key, value in lookup.items():
+                kwargs['%s__%s' % (items, key)] = value
+        tags = TaggedItem.tag_model().objects.filter(**kwargs).annotate(
+            count=models.Count(items)
+        ).order_by('-count', 'name')
+        if limit:
+            tags = tags[:limit]
+        return list(tags)
 
 
 class GenericDateQuerySet(AppHookConfigTranslatableQueryset):
@@ -81,6 +111,8 @@ class GenericDateQuerySet(AppHookConfigTranslatableQueryset):
     fallback_date_field = 'date_modified'
     end_date_field = 'date_published_end'
     publish_field = 'publish'
+    list_select_related = ('author', 'app_config', 'main_image', 'main_image_thumbnail')
+    list_prefetch_related = ('translations', 'categories', 'categories__translations', 'tags')
 
     def on_site(self, site=None):
         if not site:
@@ -127,6 +159,15 @@ class GenericDateQuerySet(AppHookConfigTranslatableQueryset):
         else:
             return self.filter(**{self.publish_field: True})
 
+    def list_ready(self):
+        """
+        Fetch in bulk the related objects needed to render a list of items
+        (see ``list_select_related`` and ``list_prefetch_related``)
+        """
+        return self.select_related(
+            *self.list_select_related
+        ).prefetch_related(*self.list_prefetch_related)
+
     def filter_by_language(self, language, current_site=True):
         if current_site:
             return self.active_translations(language_code=language).on_site()
@@ -154,6 +195,9 @@ class GenericDateTaggedManager(TaggedFilterItem, AppHookConfigTranslatableManage
     def published_future(self, current_site=True):
         return self.get_queryset().published_future(current_site)
 
+    def list_ready(self):
+        return self.get_queryset().list_ready()
+
     def filter_by_language(self, language, current_site=True):
         return self.get_queryset().filter_by_language(language, current_site)
 
@@ -163,22 +207,230 @@ class GenericDateTaggedManager(TaggedFilterItem, AppHookConfigTranslatableManage
     def get_months(self, queryset=None, current_site=True):
         """
         Get months with aggregate count (how much posts is in the month).
-        Results are ordered by date.
+        Results are ordered by date and they are computed by the database.
         """
         if queryset is None:
             queryset = self.get_queryset()
         if current_site:
             queryset = queryset.on_site()
-        dates_qs = queryset.values_list(queryset.start_date_field, queryset.fallback_date_field)
-        dates = []
-        for blog_dates in dates_qs:
-            if blog_dates[0]:
-                current_date = blog_dates[0]
-            else:
-                current_date = blog_dates[1]
-            dates.append((current_date.year, current_date.month,))
-        date_counter = Counter(dates)
-        dates = set(dates)
-        dates = sorted(dates, reverse=True)
+        # dates are truncated in UTC as datetime values are returned in UTC when USE_TZ is set
+        tzinfo = timezone.utc if settings.USE_TZ else None
+        start_field = queryset.start_date_field
+        date_counter = Counter()
+        for date_field, fallback in ((start_field, False), (queryset.fallback_date_field, True)):
+            months_qs = queryset.filter(
+                **{'%s__isnull' % start_field: fallback}
+            ).order_by().annotate(
+                month=DateTime(date_field, 'month', tzinfo)
+            ).values('month').annotate(count=models.Count('pk', distinct=True))
+            for row in months_qs:
+                if row['month']:
+                    date_counter[row['month'].year, row['month'].month] += row['count']
+        dates = sorted(date_counter, reverse=True)
         return [{'date': now().replace(year=year, month=month, day=1),
                  'count': date_counter[year, month]} for year, month in dates]
+
+
+class PostCountManager(models.Manager):
+    """
+    Manager for the denormalized published posts counters
+    """
+
+    def get_counts(self, kind, object_ids, app_config=None, site=None, language=''):
+        """
+        Return the number of published posts for each of the given objects
+
+        Stored counters include the posts regardless of their publication date and exclude
+        the ones with a publication end date: the posts scheduled in the future and the
+        expiring ones are counted live (see :py:meth:`get_scheduled_counts`), thus counts are
+        accurate without rebuilding the counters when the publication dates are reached.
+
+        :param kind: type of the counted objects (one of ``PostCount.KINDS``)
+        :param object_ids: primary keys of the counted objects
+        :param app_config: restrict the count to posts of this ``BlogConfig`` (instance or pk)
+        :param site: count posts visible on this site; if ``None`` posts on all the sites
+                     are counted
+        :param language: count posts translated in this language; if empty posts in all the
+                         languages are counted
+        :return: dictionary of object pk: posts count
+        """
+        qs = self.filter(kind=kind, object_id__in=object_ids, language=language)
+        if app_config:
+            qs = qs.filter(app_config=app_config)
+        if site:
+            qs = qs.filter(models.Q(site=site) | models.Q(site__isnull=True), all_sites=False)
+        else:
+            qs = qs.filter(all_sites=True)
+        counts = Counter(dict(
+            qs.order_by().values('object_id').annotate(
+                total=models.Sum('count')
+            ).values_list('object_id', 'total')
+        ))
+        counts.update(self.get_scheduled_counts(kind, object_ids, app_config, site, language))
+        return dict((object_id, total) for object_id, total in counts.items() if total > 0)
+
+    def get_scheduled_counts(self, kind, object_ids, app_config=None, site=None, language=''):
+        """
+        Return the correction to apply to the stored counters at the current time: minus the
+        posts whose publication date is not reached yet, plus the currently published posts
+        having a publication end date
+
+        :return: dictionary of object pk: posts count difference
+        """
+        from .models import Post
+        field = self.model.KIND_FIELDS[kind]
+        posts = Post.objects.filter(publish=True, **{'%s__in' % field: object_ids})
+        if app_config:
+            posts = posts.filter(app_config=app_config)
+        if site:
+            posts = posts.filter(
+                models.Q(sites__isnull=True) | models.Q(sites=getattr(site, 'pk', site))
+            )
+        if language:
+            posts = posts.filter(translations__language_code=language)
+        current = now()
+        rows = posts.filter(
+            models.Q(date_published__gt=current, date_published_end__isnull=True) |
+            models.Q(date_published__lte=current, date_published_end__gte=current)
+        ).order_by().values(field).annotate(
+            total=models.Count('pk', distinct=True),
+            scheduled=models.Count(
+                models.Case(models.When(date_published__gt=current, then='pk')), distinct=True
+            ),
+        )
+        counts = Counter()
+        for row in rows:
+            # scheduled posts are subtracted, expiring ones added
+            counts[row[field]] += row['total'] - 2 * row['scheduled']
+        return counts
+
+    def get_count(self, kind, object_id, app_config=None, site=None, language=''):
+        """
+        Return the number of published posts for the given object.
+
+        Unlike :py:meth:`get_counts`, the result is cached until posts or categories change.
+        """
+        key = get_posts_cache_key(
+            'count', kind, object_id, getattr(app_config, 'pk', app_config) or '',
+            getattr(site, 'pk', site) or '', language
+        )
+        count = cache.get(key)
+        if count is None:
+            counts = self.get_counts(kind, [object_id], app_config, site, language)
+            count = counts.get(object_id, 0)
+            cache.set(key, count, timeout=get_setting('PLUGIN_CACHE_TIMEOUT'))
+        return count
+
+    def attach_counts(self, objects, kind, app_config=None, site=None, language='',
+                      attribute='count'):
+        """
+        Set the published posts count on each of the given objects using a single query
+
+        :return: list of objects
+        """
+        objects = list(objects)
+        counts = self.get_counts(kind, [obj.pk for obj in objects], app_config, site, language)
+        for obj in objects:
+            setattr(obj, attribute, counts.get(obj.pk, 0))
+        return objects
+
+    def _compute(self, kind, app_config_id, object_ids=None):
+        from .models import Post
+        field = self.model.KIND_FIELDS[kind]
+        # scheduled and expiring posts are counted live by get_counts
+        posts = Post.objects.filter(
+            app_config_id=app_config_id, publish=True, date_published__isnull=False,
+            date_published_end__isnull=True
+        )
+        if object_ids is not None:
+            posts = posts.filter(**{'%s__in' % field: object_ids})
+        language = 'translations__language_code'
+        counters = []
+        groups = (
+            ((field, 'sites', language), False),
+            ((field, 'sites'), False),
+            ((field, language), True),
+            ((field,), True),
+        )
+        for group, all_sites in groups:
+            rows = posts.order_by().values(*group).annotate(
+                total=models.Count('pk', distinct=True)
+            )
+            for row in rows:
+                if row[field] is None or (language in row and not row[language]):
+                    continue
+                counters.append(self.model(
+                    kind=kind, object_id=row[field], app_config_id=app_config_id,
+                    site_id=row.get('sites'), all_sites=all_sites,
+                    language=row.get(language) or '', count=row['total']
+                ))
+        return counters
+
+    def refresh(self, kind, object_ids, app_config_id):
+        """
+        Recompute the counters of the given objects for the posts of the given ``BlogConfig``
+        """
+        object_ids = set(object_ids)
+        object_ids.discard(None)
+        if not object_ids:
+            return
+        counters = self._compute(kind, app_config_id, object_ids)
+        with transaction.atomic():
+            self.filter(kind=kind, object_id__in=object_ids, app_config_id=app_config_id).delete()
+            self.bulk_create(counters)
+
+    def rebuild(self):
+        """
+        Recompute all the counters from scratch
+        """
+        from .models import Post
+        app_config_ids = set(Post.objects.order_by().values_list('app_config_id', flat=True))
+        with transaction.atomic():
+            self.all().delete()
+            for app_config_id in app_config_ids:
+                for kind in self.model.KIND_FIELDS:
+                    self.bulk_create(self._compute(kind, app_config_id))
+
+
+class InstantArticleManager(models.Manager):
+    """
+    Manager for the pre-rendered instant articles bodies
+    """
+
+    def get_stored(self, posts, language):
+        """
+        Return the stored bodies of the given posts in the given language using a single query,
+        flagging as not fresh the ones rendered before the last modification of their post or
+        of the plugins of its content
+
+        :return: dictionary of post pk: (body, fresh)
+        """
+        modified = dict((post.pk, post.date_modified) for post in posts)
+        rows = self.filter(post_id__in=modified, language=language).annotate(
+            plugins_changed=models.Max('post__content__cmsplugin__changed_date')
+        ).values_list('post_id', 'content', 'date_rendered', 'plugins_changed')
+        stored = {}
+        for post_id, content, date_rendered, plugins_changed in rows:
+            changed = max(modified[post_id], plugins_changed or modified[post_id])
+            stored[post_id] = (content, date_rendered >= changed)
+        return stored
+
+    def get_contents(self, posts, language):
+        """
+        Return the up to date stored bodies of the given posts in the given language
+
+        :return: dictionary of post pk: body
+        """
+        return dict(
+            (post_id, content) for post_id, (content, fresh) in
+            self.get_stored(posts, language).items() if fresh
+        )
+
+    def store(self, post, language, content):
+        """
+        Save the rendered body of the given post in the given language
+        """
+        self.update_or_create(
+            post=post, language=language,
+            defaults={'content': content, 'date_rendered': now()}
+        )
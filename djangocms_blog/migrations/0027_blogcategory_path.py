@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-17 06:10
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def build_category_paths(apps, schema_editor):
+    BlogCategory = apps.get_model('djangocms_blog', 'BlogCategory')
+    parents = dict(BlogCategory.objects.values_list('pk', 'parent_id'))
+    paths = {}
+
+    def get_path(pk):
+        if pk not in paths:
+            parent_id = parents[pk]
+            paths[pk] = '{0}{1}/'.format(get_path(parent_id) if parent_id else '', pk)
+        return paths[pk]
+
+    for pk in parents:
+        BlogCategory.objects.filter(pk=pk).update(path=get_path(pk))
+
+
+def noop(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djangocms_blog', '0026_merge'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blogcategory',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=255, verbose_name='tree path'),
+        ),
+        migrations.RunPython(build_category_paths, noop),
+    ]
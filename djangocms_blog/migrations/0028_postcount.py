@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-17 06:17
+from __future__ import unicode_literals
+
+import aldryn_apphooks_config.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sites', '0002_alter_domain_unique'),
+        ('djangocms_blog', '0027_blogcategory_path'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('category', 'category'), ('tag', 'tag'), ('author', 'author')], max_length=20, verbose_name='kind')),
+                ('object_id', models.PositiveIntegerField(verbose_name='object id')),
+                ('all_sites', models.BooleanField(default=False, verbose_name='all sites')),
+                ('language', models.CharField(blank=True, default='', max_length=15, verbose_name='language')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='published posts')),
+                ('app_config', aldryn_apphooks_config.fields.AppHookConfigField(help_text='When selecting a value, the form is reloaded to get the updated default', null=True, on_delete=django.db.models.deletion.CASCADE, to='djangocms_blog.BlogConfig', verbose_name='app. config')),
+                ('site', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='sites.Site', verbose_name='site')),
+            ],
+            options={
+                'verbose_name': 'published posts counter',
+                'verbose_name_plural': 'published posts counters',
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='postcount',
+            index_together=set([('kind', 'object_id', 'language')]),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-17 07:38
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djangocms_blog', '0028_postcount'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InstantArticle',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('language', models.CharField(max_length=15, verbose_name='language')),
+                ('content', models.TextField(verbose_name='content')),
+                ('date_rendered', models.DateTimeField(default=django.utils.timezone.now, verbose_name='rendered')),
+            ],
+            options={
+                'verbose_name': 'instant article',
+                'verbose_name_plural': 'instant articles',
+            },
+        ),
+        migrations.AddField(
+            model_name='instantarticle',
+            name='post',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='instant_articles', to='djangocms_blog.Post', verbose_name='post'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='instantarticle',
+            unique_together=set([('post', 'language')]),
+        ),
+    ]
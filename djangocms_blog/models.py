@@ -2,24 +2,30 @@
 from __future__ import absolute_import, print_function, unicode_literals
 
 import hashlib
+import re
+from threading import local
 
 from aldryn_apphooks_config.fields import AppHookConfigField
 from aldryn_apphooks_config.managers.parler import AppHookConfigTranslatableManager
-from cms.models import CMSPlugin, PlaceholderField
+from cms.models import CMSPlugin, Placeholder, PlaceholderField
 from django.conf import settings as dj_settings
 from django.contrib.auth import get_user_model
+from django.contrib.sites.models import Site
 from django.contrib.sites.shortcuts import get_current_site
 from django.core.cache import cache
 from django.core.urlresolvers import reverse
-from django.db import models
-from django.db.models.signals import post_save, pre_delete
+from django.db import models, transaction
+from django.db.models import Value
+from django.db.models.functions import Concat, Substr
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
 from django.dispatch import receiver
 from django.utils import timezone
 from django.utils.encoding import force_bytes, force_text, python_2_unicode_compatible
 from django.utils.functional import cached_property
 from django.utils.html import escape, strip_tags
+from django.utils.http import urlquote
 from django.utils.text import slugify
-from django.utils.translation import get_language, ugettext_lazy as _
+from django.utils.translation import get_language, override, ugettext_lazy as _
 from django_vimeo.fields import VimeoField
 from djangocms_text_ckeditor.fields import HTMLField
 from filer.fields.image import FilerImageField
@@ -28,8 +34,11 @@ from parler.models import TranslatableModel, TranslatedFields
 from parler.utils.context import switch_language
 from taggit_autosuggest.managers import TaggableManager
 
+from .caching import (
+    get_posts_cache_key, invalidate_app_config_cache, invalidate_posts_cache, invalidate_tags,
+)
 from .cms_appconfig import BlogConfig
-from .managers import GenericDateTaggedManager
+from .managers import GenericDateTaggedManager, InstantArticleManager, PostCountManager
 from .settings import get_setting
 
 BLOG_CURRENT_POST_IDENTIFIER = get_setting('CURRENT_POST_IDENTIFIER')
@@ -45,6 +54,54 @@ thumbnail_model = '%s.%s' % (
     ThumbnailOption._meta.app_label, ThumbnailOption.__name__
 )
 
+_permalink_formats = {}
+
+_scheduled_counts = local()
+
+_post_content_placeholders = {}
+
+
+def get_permalink_format(pattern):
+    """
+    Convert a permalink regular expression into a format string relative to the blog root
+
+    :param pattern: permalink regular expression (one of ``BLOG_PERMALINK_URLS`` values)
+    :return: format string or ``None`` if the pattern can't be converted
+    """
+    if pattern not in _permalink_formats:
+        path = re.sub(r'\(\?P<(\w+)>[^)]*\)', r'{\1}', pattern)
+        path = path[1:] if path.startswith('^') else path
+        path = path[:-1] if path.endswith('$') else path
+        if re.search(r'[\\()\[\]?*+|^$.]', path):
+            path = None
+        _permalink_formats[pattern] = path
+    return _permalink_formats[pattern]
+
+
+def get_permalink_kwargs(pattern, date, slug, category=None):
+    """
+    Return the keyword arguments to reverse a post URL for the given permalink
+
+    :param pattern: permalink regular expression (one of ``BLOG_PERMALINK_URLS`` values)
+    :param date: post publishing date
+    :param slug: post slug
+    :param category: post main category slug (only needed by patterns using the category);
+                     if missing, the arguments match the slug only permalink
+    :return: dictionary
+    """
+    kwargs = {}
+    if '<year>' in pattern:
+        kwargs['year'] = date.year
+    if '<month>' in pattern:
+        kwargs['month'] = '%02d' % date.month
+    if '<day>' in pattern:
+        kwargs['day'] = '%02d' % date.day
+    if '<slug>' in pattern:
+        kwargs['slug'] = slug
+    if '<category>' in pattern and category:
+        kwargs['category'] = category
+    return kwargs
+
 
 try:
     from knocker.mixins import KnockerModel
@@ -72,6 +129,9 @@ class BlogCategory(TranslatableModel):
     app_config = AppHookConfigField(
         BlogConfig, null=True, verbose_name=_('app. config')
     )
+    path = models.CharField(
+        _('tree path'), max_length=255, blank=True, default='', db_index=True, editable=False
+    )
 
     translations = TranslatedFields(
         name=models.CharField(_('name'), max_length=255),
@@ -86,12 +146,9 @@ class BlogCategory(TranslatableModel):
         verbose_name_plural = _('blog categories')
 
     def descendants(self):
-        children = []
-        if self.children.exists():
-            children.extend(self.children.all())
-            for child in self.children.all():
-                children.extend(child.descendants())
-        return children
+        if not self.path:
+            return []
+        return list(BlogCategory.objects.filter(path__startswith=self.path).exclude(pk=self.pk))
 
     @cached_property
     def linked_posts(self):
@@ -99,19 +156,48 @@ class BlogCategory(TranslatableModel):
 
     @cached_property
     def count(self):
-        return self.linked_posts.published().count()
+        return PostCount.objects.get_count(
+            PostCount.CATEGORY, self.pk, self.app_config_id, site=Site.objects.get_current()
+        )
 
     @cached_property
     def count_all_sites(self):
-        return self.linked_posts.published(current_site=False).count()
+        return PostCount.objects.get_count(PostCount.CATEGORY, self.pk, self.app_config_id)
 
     @staticmethod
     def get_sub_category_ids(category):
-        ids = []
-        for sub_category_id in BlogCategory.objects.filter(parent_id=category.pk).only('id'):
-            ids.append(sub_category_id)
-            ids.extend(BlogCategory.get_sub_category_ids(sub_category_id))
-        return ids
+        if not category.path:
+            return []
+        return list(BlogCategory.objects.filter(
+            path__startswith=category.path
+        ).exclude(pk=category.pk).values_list('pk', flat=True))
+
+    def _build_path(self):
+        """
+        Materialized path of the category: the primary keys of its ancestors and its own,
+        each followed by ``/``
+        """
+        parent_path = self.parent.path if self.parent_id else ''
+        return '{0}{1}/'.format(parent_path, self.pk)
+
+    def _update_path(self):
+        """
+        Sync the materialized path of the category and its descendants after the category
+        has been created or moved in the tree.
+        """
+        old_path = self.path
+        new_path = self._build_path()
+        if old_path == new_path:
+            return
+        self.path = new_path
+        BlogCategory.objects.filter(pk=self.pk).update(path=new_path)
+        if old_path:
+            BlogCategory.objects.filter(
+                path__startswith=old_path
+            ).exclude(pk=self.pk).update(path=Concat(
+                Value(new_path), Substr('path', len(old_path) + 1),
+                output_field=models.CharField()
+            ))
 
     def get_absolute_url(self, lang=None):
         if not lang:
@@ -134,6 +220,7 @@ class BlogCategory(TranslatableModel):
 
     def save(self, *args, **kwargs):
         super(BlogCategory, self).save(*args, **kwargs)
+        self._update_path()
         for lang in self.get_available_languages():
             self.set_current_language(lang)
             if not self.slug and self.name:
@@ -239,6 +326,7 @@ class Post(KnockerModel, ModelMeta, TranslatableModel):
         verbose_name_plural = _('blog articles')
         ordering = ('-date_published', '-date_created')
         get_latest_by = 'date_published'
+        index_together = (('app_config', 'publish', 'date_published', 'date_published_end'),)
 
     def __str__(self):
         return self.safe_translation_getter('title')
@@ -259,6 +347,7 @@ class Post(KnockerModel, ModelMeta, TranslatableModel):
         """
         if self.publish and self.date_published is None:
             self.date_published = timezone.now()
+        self._clear_absolute_urls()
         super(Post, self).save(*args, **kwargs)
 
     def save_translation(self, translation, *args, **kwargs):
@@ -269,30 +358,88 @@ class Post(KnockerModel, ModelMeta, TranslatableModel):
             translation.slug = slugify(translation.title)
         super(Post, self).save_translation(translation, *args, **kwargs)
 
-    def get_absolute_url(self, lang=None):
-        if not lang or lang not in self.get_available_languages():
+    def _get_url_language(self, lang=None):
+        available_languages = self.get_available_languages()
+        if not lang or lang not in available_languages:
             lang = self.get_current_language()
-        if not lang or lang not in self.get_available_languages():
+        if not lang or lang not in available_languages:
             lang = get_language()
-        with switch_language(self, lang):
-            category = self.categories.first()
-            kwargs = {}
-            if self.date_published:
-                current_date = self.date_published
-            else:
-                current_date = self.date_created
-            urlconf = get_setting('PERMALINK_URLS')[self.app_config.url_patterns]
-            if '<year>' in urlconf:
-                kwargs['year'] = current_date.year
-            if '<month>' in urlconf:
-                kwargs['month'] = '%02d' % current_date.month
-            if '<day>' in urlconf:
-                kwargs['day'] = '%02d' % current_date.day
-            if '<slug>' in urlconf:
-                kwargs['slug'] = self.safe_translation_getter('slug', language_code=lang, any_language=True)  # NOQA
-            if '<category>' in urlconf:
-                kwargs['category'] = category.safe_translation_getter('slug', language_code=lang, any_language=True)  # NOQA
-            return reverse('%s:post-detail' % self.app_config.namespace, kwargs=kwargs)
+        return lang
+
+    def _get_permalink_kwargs(self, lang):
+        if self.date_published:
+            current_date = self.date_published
+        else:
+            current_date = self.date_created
+        urlconf = get_setting('PERMALINK_URLS')[self.app_config.url_patterns]
+        slug = self.safe_translation_getter('slug', language_code=lang, any_language=True)
+        category = None
+        if '<category>' in urlconf:
+            # same as categories.first(), but it uses prefetched categories if available
+            categories = self.categories.all()
+            if categories:
+                category = min(categories, key=lambda item: item.pk)
+                category = category.safe_translation_getter('slug', language_code=lang, any_language=True)  # NOQA
+        return get_permalink_kwargs(urlconf, current_date, slug, category)
+
+    def _get_url_key(self, lang):
+        return lang, self.app_config_id, self.app_config.url_patterns, self.date_published
+
+    def _clear_absolute_urls(self):
+        self.__dict__.pop('_absolute_urls', None)
+
+    def get_absolute_url(self, lang=None):
+        """
+        Return the post URL; URLs are memoized per language and permalink on the instance
+        """
+        lang = self._get_url_language(lang)
+        key = self._get_url_key(lang)
+        urls = self.__dict__.setdefault('_absolute_urls', {})
+        if key not in urls:
+            with switch_language(self, lang):
+                urls[key] = reverse(
+                    '%s:post-detail' % self.app_config.namespace,
+                    kwargs=self._get_permalink_kwargs(lang)
+                )
+        return urls[key]
+
+    @classmethod
+    def get_absolute_urls(cls, posts, lang=None):
+        """
+        Compute the URLs of the given posts in bulk.
+
+        A single URL is reversed for each blog and language, and post URLs are built from the
+        permalink pattern. Computed URLs are memoized on the instances, thus subsequent
+        :py:meth:`get_absolute_url` calls are free.
+
+        :param posts: iterable of posts; fetch them with ``list_ready`` to avoid further queries
+        :param lang: language of the URLs (it falls back to each post language)
+        :return: list of URLs (in the same order of posts)
+        """
+        prefixes = {}
+        results = []
+        for post in posts:
+            post_lang = post._get_url_language(lang)
+            key = post._get_url_key(post_lang)
+            urls = post.__dict__.setdefault('_absolute_urls', {})
+            if key not in urls:
+                namespace = post.app_config.namespace
+                pattern = get_setting('PERMALINK_URLS')[post.app_config.url_patterns]
+                path = get_permalink_format(pattern)
+                kwargs = post._get_permalink_kwargs(post_lang)
+                if path is None or ('<category>' in pattern and 'category' not in kwargs):
+                    # posts with no category use the slug only permalink
+                    post.get_absolute_url(post_lang)
+                else:
+                    if (namespace, post_lang) not in prefixes:
+                        with override(post_lang):
+                            prefixes[namespace, post_lang] = reverse(
+                                '%s:posts-latest' % namespace
+                            )
+                    kwargs = dict((key, urlquote(value)) for key, value in kwargs.items())
+                    urls[key] = prefixes[namespace, post_lang] + path.format(**kwargs)
+            results.append(urls[key])
+        return results
 
     def get_meta_attribute(self, param):
         """
@@ -398,6 +545,66 @@ class Post(KnockerModel, ModelMeta, TranslatableModel):
         )
 
 
+class PostCount(models.Model):
+    """
+    Denormalized number of published posts per category, tag and author.
+
+    Counters are stored per site and language: rows with no site hold the posts visible on all
+    the sites, rows flagged with ``all_sites`` hold the total regardless of the sites, rows with
+    no language hold the total regardless of the translations.
+    """
+    CATEGORY = 'category'
+    TAG = 'tag'
+    AUTHOR = 'author'
+    KINDS = (
+        (CATEGORY, _('category')),
+        (TAG, _('tag')),
+        (AUTHOR, _('author')),
+    )
+    KIND_FIELDS = {
+        CATEGORY: 'categories',
+        TAG: 'tags',
+        AUTHOR: 'author',
+    }
+
+    kind = models.CharField(_('kind'), max_length=20, choices=KINDS)
+    object_id = models.PositiveIntegerField(_('object id'))
+    app_config = AppHookConfigField(
+        BlogConfig, null=True, verbose_name=_('app. config')
+    )
+    site = models.ForeignKey('sites.Site', verbose_name=_('site'), null=True, blank=True)
+    all_sites = models.BooleanField(_('all sites'), default=False)
+    language = models.CharField(_('language'), max_length=15, blank=True, default='')
+    count = models.PositiveIntegerField(_('published posts'), default=0)
+
+    objects = PostCountManager()
+
+    class Meta:
+        verbose_name = _('published posts counter')
+        verbose_name_plural = _('published posts counters')
+        index_together = (('kind', 'object_id', 'language'),)
+
+
+class InstantArticle(models.Model):
+    """
+    Pre-rendered body of the Facebook instant article of a post translation.
+
+    Bodies are rendered when posts are saved (if ``BLOG_FEED_INSTANT_PRERENDER`` is set) or by
+    the ``prerender_instant_articles`` command, thus the feed only has to assemble them.
+    """
+    post = models.ForeignKey(Post, verbose_name=_('post'), related_name='instant_articles')
+    language = models.CharField(_('language'), max_length=15)
+    content = models.TextField(_('content'))
+    date_rendered = models.DateTimeField(_('rendered'), default=timezone.now)
+
+    objects = InstantArticleManager()
+
+    class Meta:
+        verbose_name = _('instant article')
+        verbose_name_plural = _('instant articles')
+        unique_together = (('post', 'language'),)
+
+
 class BasePostPlugin(CMSPlugin):
     app_config = AppHookConfigField(
         BlogConfig, null=True, verbose_name=_('app. config'), blank=True
@@ -458,7 +665,7 @@ class LatestPostsPlugin(BasePostPlugin):
             posts = posts.filter(tags__in=list(self.tags.all()))
         if self.categories.exists():
             posts = posts.filter(categories__in=list(self.categories.all()))
-        return posts.distinct()[:self.latest_posts]
+        return posts.distinct().list_ready()[:self.latest_posts]
 
 
 @python_2_unicode_compatible
@@ -480,23 +687,27 @@ class AuthorEntriesPlugin(BasePostPlugin):
 
     def get_posts(self, request, published_only=True):
         posts = self.post_queryset(request, published_only)
-        return posts[:self.latest_posts]
-
-    def get_authors(self):
-        authors = self.authors.all()
-        for author in authors:
-            author.count = 0
-            qs = author.djangocms_blog_post_author
-            if self.app_config:
-                qs = qs.namespace(self.app_config.namespace)
-            if self.current_site:
-                qs = qs.published()
-            else:
-                qs = qs.published(current_site=False)
-            count = qs.count()
-            if count:
-                author.count = count
-        return authors
+        return posts.list_ready()[:self.latest_posts]
+
+    def get_authors(self, cached=False):
+        """
+        Return the plugin authors annotated with the number of published posts (``count``)
+
+        :param cached: cache the authors list until posts or plugin are changed
+        """
+        site = Site.objects.get_current() if self.current_site else None
+        if cached:
+            key = get_posts_cache_key(
+                'author-plugin', self.pk, self.changed_date.isoformat(), site.pk if site else ''
+            )
+            authors = cache.get(key)
+            if authors is None:
+                authors = self.get_authors()
+                cache.set(key, authors, timeout=get_setting('PLUGIN_CACHE_TIMEOUT'))
+            return authors
+        return PostCount.objects.attach_counts(
+            self.authors.all(), PostCount.AUTHOR, app_config=self.app_config_id, site=site
+        )
 
 
 @python_2_unicode_compatible
@@ -509,15 +720,286 @@ class GenericBlogPlugin(BasePostPlugin):
         return force_text(_('generic blog plugin'))
 
 
+def _get_scheduled_post_counts():
+    if getattr(_scheduled_counts, 'pending', None) is None:
+        _scheduled_counts.pending = {
+            'counts': {}, 'app_configs': set(), 'cache_tags': set(), 'tags': set(),
+        }
+    # callbacks are discarded on rollback: registering on every call is harmless as the
+    # first one run consumes all the pending updates
+    transaction.on_commit(update_scheduled_post_counts)
+    return _scheduled_counts.pending
+
+
+def schedule_post_counts_update(post, kinds=(), app_config_ids=(), categories=(), tags=(),
+                                authors=(), lists=True):
+    """
+    Refresh the published posts counters related to the given post and invalidate the cached
+    posts data once the current transaction is committed.
+
+    Updates scheduled in the same transaction are merged, thus saving a post, its translations
+    and its relations refreshes each counter only once.
+
+    :param post: post instance
+    :param kinds: counters (``PostCount.KINDS``) to refresh for all the objects related to the
+                  post, because the post may have been added to or removed from the counted ones
+    :param app_config_ids: additional ``BlogConfig`` pks to refresh the counters for
+    :param categories: category pks to refresh (e.g.: categories just attached or detached)
+    :param tags: tag pks to refresh
+    :param authors: author pks to refresh
+    :param lists: whether the post may have been added to or removed from the posts lists
+    """
+    pending = _get_scheduled_post_counts()
+    app_config_ids = set(app_config_ids)
+    app_config_ids.add(post.app_config_id)
+    app_config_ids.discard(None)
+    pending['app_configs'].update(app_config_ids)
+    pending['cache_tags'].add('post:{0}'.format(post.pk))
+    if lists:
+        pending['cache_tags'].update('blog-posts:{0}'.format(pk) for pk in app_config_ids)
+    related = {
+        PostCount.CATEGORY: (categories, lambda: post.categories.values_list('pk', flat=True)),
+        PostCount.TAG: (tags, lambda: post.tags.values_list('pk', flat=True)),
+        PostCount.AUTHOR: (authors, lambda: [post.author_id]),
+    }
+    for kind, (object_ids, current) in related.items():
+        object_ids = set(object_ids)
+        if kind in kinds:
+            object_ids.update(current())
+        object_ids.discard(None)
+        if not object_ids:
+            continue
+        for app_config_id in app_config_ids:
+            pending['counts'].setdefault((app_config_id, kind), set()).update(object_ids)
+        if lists:
+            if kind == PostCount.TAG:
+                pending['tags'].update(object_ids)
+            else:
+                pending['cache_tags'].update(
+                    '{0}-posts:{1}'.format(kind, pk) for pk in object_ids
+                )
+
+
+def update_scheduled_post_counts():
+    """
+    Refresh the counters and invalidate the cached data scheduled by
+    :py:func:`schedule_post_counts_update`
+    """
+    pending = getattr(_scheduled_counts, 'pending', None)
+    if not pending:
+        return
+    _scheduled_counts.pending = None
+    for (app_config_id, kind), object_ids in pending['counts'].items():
+        PostCount.objects.refresh(kind, object_ids, app_config_id)
+    for app_config_id in pending['app_configs']:
+        invalidate_app_config_cache(app_config_id)
+    invalidate_posts_cache()
+    cache_tags = pending['cache_tags']
+    if pending['tags']:
+        cache_tags.update('tag-posts:{0}'.format(slug) for slug in (
+            Post.tags.through.tag_model().objects.filter(
+                pk__in=pending['tags']
+            ).values_list('slug', flat=True)
+        ))
+    invalidate_tags(cache_tags)
+
+
+POST_LISTED_FIELDS = (
+    'app_config_id', 'author_id', 'publish', 'date_published', 'date_published_end'
+)
+
+
+@receiver(pre_save, sender=Post)
+def pre_save_post_counts(sender, instance, raw=False, **kwargs):
+    if not raw and instance.pk:
+        instance._previous_listed = Post.objects.filter(
+            pk=instance.pk
+        ).values_list(*POST_LISTED_FIELDS).first()
+
+
+@receiver(post_save, sender=Post)
+def post_save_post_counts(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_previous_listed', None) or (None,) * len(POST_LISTED_FIELDS)
+    current = tuple(getattr(instance, field) for field in POST_LISTED_FIELDS)
+    listed = previous != current
+    # counters only change if the post is added to or removed from the published ones
+    schedule_post_counts_update(
+        instance, kinds=PostCount.KIND_FIELDS if listed else (), app_config_ids=[previous[0]],
+        authors=[previous[1]] if listed else (), lists=listed
+    )
+
+
 @receiver(pre_delete, sender=Post)
-def pre_delete_post(sender, instance, **kwargs):
-    for language in instance.get_available_languages():
-        key = instance.get_cache_key(language, 'feed')
-        cache.delete(key)
+def pre_delete_post_counts(sender, instance, **kwargs):
+    instance._previous_counted_relations = {
+        'categories': list(instance.categories.values_list('pk', flat=True)),
+        'tags': list(instance.tags.values_list('pk', flat=True)),
+    }
+
+
+@receiver(post_delete, sender=Post)
+def post_delete_post_counts(sender, instance, **kwargs):
+    schedule_post_counts_update(
+        instance, kinds=[PostCount.AUTHOR], **getattr(instance, '_previous_counted_relations', {})
+    )
+
+
+@receiver(post_save, sender=Post._parler_meta.root_model)
+@receiver(post_delete, sender=Post._parler_meta.root_model)
+def post_translation_post_counts(sender, instance, raw=False, created=True, **kwargs):
+    if not raw:
+        try:
+            # posts lists and counters are filtered by language
+            schedule_post_counts_update(
+                instance.master, kinds=PostCount.KIND_FIELDS if created else (), lists=created
+            )
+        except Post.DoesNotExist:  # pragma: no cover
+            # translations deleted together with the post
+            pass
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+@receiver(post_save, sender=Post._parler_meta.root_model)
+@receiver(post_delete, sender=Post._parler_meta.root_model)
+def update_post_sitemap_shards(sender, instance, raw=False, **kwargs):
+    if not raw and get_setting('SITEMAP_SHARDS_AUTO_UPDATE'):
+        from .sitemaps.shards import schedule_sitemap_shards_update
+        try:
+            post = instance if sender is Post else instance.master
+        except Post.DoesNotExist:  # pragma: no cover
+            # translations deleted together with the post
+            return
+        schedule_sitemap_shards_update(post.app_config.namespace)
 
 
 @receiver(post_save, sender=Post)
-def post_save_post(sender, instance, **kwargs):
-    for language in instance.get_available_languages():
-        key = instance.get_cache_key(language, 'feed')
-        cache.delete(key)
+@receiver(post_save, sender=Post._parler_meta.root_model)
+def prerender_post_instant_articles(sender, instance, raw=False, **kwargs):
+    if not raw and get_setting('FEED_INSTANT_PRERENDER'):
+        from .feeds import prerender_instant_articles
+        if sender is Post:
+            # translations are saved after the post: stale bodies are rendered once committed
+            transaction.on_commit(lambda: prerender_instant_articles([instance]))
+        else:
+            prerender_instant_articles(
+                [instance.master], languages=[instance.language_code], force=True
+            )
+
+
+def _is_post_content(placeholder_id):
+    """
+    Return whether the given placeholder is the content of a post; as placeholders never
+    change their slot, results are memoized, thus plugins deleted from other placeholders
+    (e.g.: when publishing pages) cost at most one query per placeholder
+    """
+    if placeholder_id not in _post_content_placeholders:
+        if len(_post_content_placeholders) > 10000:
+            _post_content_placeholders.clear()
+        _post_content_placeholders[placeholder_id] = Placeholder.objects.filter(
+            pk=placeholder_id, slot=Post._meta.get_field('content').slotname
+        ).exists()
+    return _post_content_placeholders[placeholder_id]
+
+
+@receiver(post_delete, sender=Placeholder)
+def post_delete_placeholder_instant_articles(sender, instance, **kwargs):
+    # ids of deleted placeholders may be reused
+    _post_content_placeholders.pop(instance.pk, None)
+
+
+@receiver(post_delete, sender=CMSPlugin)
+def post_delete_plugin_instant_articles(sender, instance, **kwargs):
+    # deleting a plugin doesn't change the latest plugins modification date
+    if instance.placeholder_id and _is_post_content(instance.placeholder_id):
+        InstantArticle.objects.filter(post__content_id=instance.placeholder_id).delete()
+
+
+@receiver(post_delete, sender=BlogCategory)
+def post_delete_category_counts(sender, instance, **kwargs):
+    PostCount.objects.filter(kind=PostCount.CATEGORY, object_id=instance.pk).delete()
+    invalidate_posts_cache()
+
+
+@receiver(post_save, sender=BlogCategory)
+@receiver(post_save, sender=BlogCategory._parler_meta.root_model)
+@receiver(post_delete, sender=BlogCategory._parler_meta.root_model)
+def post_save_category_cache(sender, instance, **kwargs):
+    try:
+        category = instance if sender is BlogCategory else instance.master
+    except BlogCategory.DoesNotExist:  # pragma: no cover
+        category = None
+    if category and category.app_config_id:
+        invalidate_app_config_cache(category.app_config_id)
+    if category:
+        invalidate_tags(
+            ['category:{0}'.format(pk) for pk in (category.pk, category.parent_id) if pk]
+        )
+    invalidate_posts_cache()
+
+
+@receiver(post_save, sender=BlogConfig)
+def post_save_config_cache(sender, instance, **kwargs):
+    invalidate_app_config_cache(instance.pk)
+    invalidate_tags(['blog:{0}'.format(instance.pk)])
+
+
+def _m2m_post_counts(instance, action, reverse, pk_set, related):
+    """
+    Refresh counters when the posts relations change
+
+    :param related: keyword argument of :py:func:`schedule_post_counts_update` matching the
+                    relation
+    """
+    if action == 'pre_clear':
+        if not reverse:
+            pk_set = getattr(instance, related).values_list('pk', flat=True)
+        else:
+            pk_set = instance.blog_posts.values_list('pk', flat=True)
+        instance._previous_counted_m2m = set(pk_set)
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        if action == 'post_clear':
+            pk_set = getattr(instance, '_previous_counted_m2m', set())
+        # only the counters of the attached or detached objects change
+        if not reverse:
+            schedule_post_counts_update(instance, **{related: pk_set})
+        else:
+            for post in Post.objects.filter(pk__in=pk_set):
+                schedule_post_counts_update(post, **{related: [instance.pk]})
+
+
+@receiver(m2m_changed, sender=Post.categories.through)
+def m2m_categories_post_counts(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        instance._clear_absolute_urls()
+    _m2m_post_counts(instance, action, reverse, pk_set, 'categories')
+
+
+@receiver(m2m_changed, sender=Post.sites.through)
+def m2m_sites_post_counts(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':
+        instance._previous_counted_m2m = set(
+            Post.objects.filter(sites=instance).values_list('pk', flat=True)
+        )
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        if not reverse:
+            schedule_post_counts_update(instance, kinds=PostCount.KIND_FIELDS)
+            return
+        if action == 'post_clear':
+            pk_set = getattr(instance, '_previous_counted_m2m', set())
+        for post in Post.objects.filter(pk__in=pk_set):
+            schedule_post_counts_update(post, kinds=PostCount.KIND_FIELDS)
+
+
+@receiver(m2m_changed, sender=AuthorEntriesPlugin.authors.through)
+def m2m_plugin_authors_cache(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        invalidate_posts_cache()
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def m2m_tags_post_counts(sender, instance, action, reverse, pk_set, **kwargs):
+    if isinstance(instance, Post):
+        _m2m_post_counts(instance, action, reverse, pk_set, 'tags')
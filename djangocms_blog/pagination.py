@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function, unicode_literals
+
+from datetime import datetime, timedelta
+from math import ceil
+
+from django.conf import settings
+from django.core.paginator import InvalidPage
+from django.db.models import Q
+from django.utils.functional import cached_property
+from django.utils.timezone import utc
+
+AFTER = 'a'
+BEFORE = 'b'
+
+
+def _get_epoch():
+    return datetime(1970, 1, 1, tzinfo=utc if settings.USE_TZ else None)
+
+
+def encode_cursor(number, direction, date, pk):
+    """
+    Return the cursor of the page with the given number, starting after (or ending before)
+    the post with the given publication date and primary key
+    """
+    delta = date - _get_epoch()
+    micros = (delta.days * 86400 + delta.seconds) * 10 ** 6 + delta.microseconds
+    return '{0}.{1}.{2}.{3}'.format(number, direction, micros, pk)
+
+
+def decode_cursor(cursor):
+    """
+    Parse a cursor built by :py:func:`encode_cursor`; ``1`` (or an empty value) is the
+    cursor of the first page
+
+    :return: tuple of page number, direction and key (tuple of publication date and primary
+             key, ``None`` for the first page)
+    """
+    cursor = '{0}'.format(cursor or 1)
+    if cursor == '1':
+        return 1, AFTER, None
+    try:
+        number, direction, micros, pk = cursor.split('.')
+        number, micros, pk = int(number), int(micros), int(pk)
+        date = _get_epoch() + timedelta(microseconds=micros)
+    except (ValueError, OverflowError):
+        raise InvalidPage('Invalid cursor: %r' % cursor)
+    if direction not in (AFTER, BEFORE) or number < 1:
+        raise InvalidPage('Invalid cursor: %r' % cursor)
+    return number, direction, (date, pk)
+
+
+class KeysetPaginator(object):
+    """
+    Paginate the posts seeking on ``(date_published, pk)`` instead of using offsets, thus
+    deep pages are as cheap as the first one.
+
+    Pages are identified by cursors instead of numbers, and the total number of items is
+    only computed if a ``count`` callable is given.
+    """
+
+    def __init__(self, queryset, per_page, count=None):
+        self.queryset = queryset.order_by('-date_published', '-pk')
+        self.per_page = int(per_page)
+        self._count = count
+
+    @cached_property
+    def count(self):
+        if self._count is not None:
+            return self._count()
+
+    @cached_property
+    def num_pages(self):
+        if self.count is not None:
+            return max(1, int(ceil(self.count / float(self.per_page))))
+
+    def page(self, cursor):
+        """
+        Return the page identified by the given cursor
+
+        :raise InvalidPage: if the cursor is malformed
+        """
+        number, direction, key = decode_cursor(cursor)
+        queryset = self.queryset
+        if key:
+            date, pk = key
+            if direction == AFTER:
+                queryset = queryset.filter(
+                    Q(date_published__lt=date) | Q(date_published=date, pk__lt=pk)
+                )
+            else:
+                queryset = queryset.filter(
+                    Q(date_published__gt=date) | Q(date_published=date, pk__gt=pk)
+                ).reverse()
+        object_list = list(queryset[:self.per_page + 1])
+        has_more = len(object_list) > self.per_page
+        object_list = object_list[:self.per_page]
+        if direction == AFTER:
+            has_previous, has_next = key is not None, has_more
+        else:
+            object_list.reverse()
+            has_previous, has_next = has_more, True
+        if not has_previous:
+            number = 1
+        return KeysetPage(object_list, number, self, has_previous, has_next)
+
+
+class KeysetPage(object):
+    """
+    Page of :py:class:`KeysetPaginator`, exposing the same interface of django pages:
+    previous and next page "numbers" are the cursors to pass as ``page`` parameter
+    """
+
+    def __init__(self, object_list, number, paginator, has_previous, has_next):
+        self.object_list = object_list
+        self.number = number
+        self.paginator = paginator
+        self._has_previous = has_previous
+        self._has_next = has_next
+
+    def __repr__(self):
+        return '<Page {0}>'.format(self.number)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self._has_next and bool(self.object_list)
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self.has_previous() or self.has_next()
+
+    def next_page_number(self):
+        last = self.object_list[-1]
+        return encode_cursor(self.number + 1, AFTER, last.date_published, last.pk)
+
+    def previous_page_number(self):
+        if self.number <= 2:
+            return 1
+        first = self.object_list[0]
+        return encode_cursor(self.number - 1, BEFORE, first.date_published, first.pk)
+
+    def start_index(self):
+        if not self.object_list:
+            return 0
+        return self.paginator.per_page * (self.number - 1) + 1
+
+    def end_index(self):
+        return self.start_index() + len(self.object_list) - 1 if self.object_list else 0
@@ -1,13 +1,23 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, print_function, unicode_literals
 
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
 MENU_TYPE_COMPLETE = 'complete'
 MENU_TYPE_CATEGORIES = 'categories'
 MENU_TYPE_POSTS = 'posts'
 MENU_TYPE_NONE = 'none'
+PAGINATION_OFFSET = 'offset'
+PAGINATION_KEYSET = 'keyset'
+PAGINATION_COUNT_EXACT = 'exact'
+PAGINATION_COUNT_CACHED = 'cached'
+PAGINATION_COUNT_NONE = 'none'
 
+_settings_registry = {}
 
-def get_setting(name):
+
+def _build_settings():
     from django.conf import settings
     from django.utils.translation import ugettext_lazy as _
     from meta import settings as meta_settings
@@ -30,6 +40,15 @@ def get_setting(name):
         (MENU_TYPE_POSTS, _('Posts only')),
         (MENU_TYPE_NONE, _('None')),
     )
+    PAGINATION_MODES = (
+        (PAGINATION_OFFSET, _('Page numbers')),
+        (PAGINATION_KEYSET, _('Next / previous cursors')),
+    )
+    PAGINATION_COUNTS = (
+        (PAGINATION_COUNT_EXACT, _('Count on each request')),
+        (PAGINATION_COUNT_CACHED, _('Cached count')),
+        (PAGINATION_COUNT_NONE, _('No count')),
+    )
     SITEMAP_CHANGEFREQ_LIST = (
         ('always', _('always')),
         ('hourly', _('hourly')),
@@ -53,12 +72,21 @@ def get_setting(name):
         }),
 
         'BLOG_PAGINATION': getattr(settings, 'BLOG_PAGINATION', 10),
+        'BLOG_PAGINATION_MODES': PAGINATION_MODES,
+        'BLOG_PAGINATION_MODE': getattr(settings, 'BLOG_PAGINATION_MODE', PAGINATION_OFFSET),
+        'BLOG_PAGINATION_COUNTS': PAGINATION_COUNTS,
+        'BLOG_PAGINATION_COUNT': getattr(
+            settings, 'BLOG_PAGINATION_COUNT', PAGINATION_COUNT_EXACT
+        ),
         'BLOG_LATEST_POSTS': getattr(settings, 'BLOG_LATEST_POSTS', 5),
         'BLOG_POSTS_LIST_TRUNCWORDS_COUNT': getattr(
             settings, 'BLOG_POSTS_LIST_TRUNCWORDS_COUNT', 100
         ),
         'BLOG_MENU_TYPES': MENU_TYPES,
         'BLOG_MENU_EMPTY_CATEGORIES': getattr(settings, 'MENU_EMPTY_CATEGORIES', True),
+        'BLOG_MENU_POSTS_LIMIT': getattr(settings, 'BLOG_MENU_POSTS_LIMIT', 0),
+        'BLOG_MENU_POSTS_PER_CATEGORY': getattr(settings, 'BLOG_MENU_POSTS_PER_CATEGORY', 0),
+        'BLOG_MENU_POSTS_CURRENT_YEAR': getattr(settings, 'BLOG_MENU_POSTS_CURRENT_YEAR', False),
         'BLOG_TYPE': getattr(settings, 'BLOG_TYPE', 'Article'),
         'BLOG_TYPES': meta_settings.OBJECT_TYPES,
         'BLOG_FB_TYPE': getattr(settings, 'BLOG_FB_TYPE', 'Article'),
@@ -103,6 +131,13 @@ def get_setting(name):
         'BLOG_SITEMAP_CHANGEFREQ_DEFAULT': getattr(
             settings, 'BLOG_SITEMAP_CHANGEFREQ_DEFAULT', 'monthly'
         ),
+        'BLOG_SITEMAP_SHARDS_PATH': getattr(
+            settings, 'BLOG_SITEMAP_SHARDS_PATH', 'djangocms_blog/sitemaps'
+        ),
+        'BLOG_SITEMAP_SHARD_SIZE': getattr(settings, 'BLOG_SITEMAP_SHARD_SIZE', 10000),
+        'BLOG_SITEMAP_SHARDS_AUTO_UPDATE': getattr(
+            settings, 'BLOG_SITEMAP_SHARDS_AUTO_UPDATE', False
+        ),
 
         'BLOG_ENABLE_SEARCH': getattr(settings, 'BLOG_ENABLE_SEARCH', True),
         'BLOG_CURRENT_POST_IDENTIFIER': getattr(
@@ -127,8 +162,20 @@ def get_setting(name):
             settings, 'BLOG_ARCHIVE_PLUGIN_NAME', _('Archive')),
         'BLOG_FEED_CACHE_TIMEOUT': getattr(
             settings, 'BLOG_FEED_CACHE_TIMEOUT', 3600),
+        'BLOG_PLUGIN_CACHE_TIMEOUT': getattr(
+            settings, 'BLOG_PLUGIN_CACHE_TIMEOUT', 3600),
+        'BLOG_CACHE_LOCK_TIMEOUT': getattr(
+            settings, 'BLOG_CACHE_LOCK_TIMEOUT', 60),
+        'BLOG_CACHE_LOCK_WAIT': getattr(
+            settings, 'BLOG_CACHE_LOCK_WAIT', 5),
+        'BLOG_LIST_CACHE_TIMEOUT': getattr(
+            settings, 'BLOG_LIST_CACHE_TIMEOUT', 0),
+        'BLOG_PAGINATION_COUNT_TIMEOUT': getattr(
+            settings, 'BLOG_PAGINATION_COUNT_TIMEOUT', 3600),
         'BLOG_FEED_INSTANT_ITEMS': getattr(
             settings, 'BLOG_FEED_INSTANT_ITEMS', 50),
+        'BLOG_FEED_INSTANT_PRERENDER': getattr(
+            settings, 'BLOG_FEED_INSTANT_PRERENDER', False),
         'BLOG_FEED_LATEST_ITEMS': getattr(
             settings, 'BLOG_FEED_LATEST_ITEMS', 10),
         'BLOG_FEED_TAGS_ITEMS': getattr(
@@ -140,4 +187,24 @@ def get_setting(name):
             settings, 'BLOG_PLUGIN_TEMPLATE_FOLDERS', (('plugins', _('Default template')),)),
 
     }
-    return default['BLOG_%s' % name]
+    return default
+
+
+def get_setting(name):
+    """
+    Return the resolved value of the ``BLOG_<name>`` setting.
+
+    Settings are resolved once and memoized in a module level registry; the registry is
+    emptied whenever Django emits ``setting_changed`` (e.g.: when using ``override_settings``).
+    """
+    if not _settings_registry:
+        _settings_registry.update(_build_settings())
+    return _settings_registry['BLOG_%s' % name]
+
+
+@receiver(setting_changed)
+def clear_settings_registry(**kwargs):
+    """
+    Empty the settings registry so that it's rebuilt on next access
+    """
+    _settings_registry.clear()
@@ -1,35 +1,263 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, print_function, unicode_literals
 
+import hashlib
+
+try:
+    from collections.abc import Mapping
+except ImportError:  # pragma: no cover
+    from collections import Mapping
+
 from cms.utils import get_language_list
 from django.contrib.sitemaps import Sitemap
-from parler.utils.context import smart_override
+from django.core.urlresolvers import reverse
+from django.db import models
+from django.utils.encoding import force_bytes
+from django.utils.http import urlquote
+from django.utils.translation import override
 
-from ..models import Post
+from ..cms_appconfig import BlogConfig
+from ..models import BlogCategory, Post, get_permalink_format, get_permalink_kwargs
 from ..settings import get_setting
 
 
+class PostSitemapItems(object):
+    """
+    Lazy sequence of the sitemap items.
+
+    Only the number of items is computed upfront; items are fetched by slicing the sequence
+    (as the sitemap paginator does) using a ``values()`` projection of the posts
+    translations, and their URLs are computed in bulk.
+    """
+
+    fields = (
+        'master_id', 'language_code', 'slug', 'master__app_config_id',
+        'master__date_published', 'master__date_created', 'master__date_modified',
+    )
+
+    def __init__(self, sitemap, queryset):
+        self.sitemap = sitemap
+        self.queryset = queryset
+
+    def count(self):
+        return self.queryset.count()
+
+    def __len__(self):
+        return self.count()
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            rows = list(self.queryset.values(*self.fields)[index])
+            items = []
+            categories = self._get_categories(rows)
+            for row in rows:
+                item = {
+                    'id': row['master_id'],
+                    'language': row['language_code'],
+                    'app_config_id': row['master__app_config_id'],
+                    'date_modified': row['master__date_modified'],
+                }
+                item['location'] = self.sitemap.get_location(
+                    row, categories.get((row['master_id'], row['language_code']))
+                )
+                items.append(item)
+            return items
+        return self[index:index + 1][0]
+
+    def get_signature(self, start, size):
+        """
+        Return a signature of the given page of items computed in the database, without
+        fetching the items: it changes when items are added, removed or modified (judged by
+        the posts ``date_modified``), or when their permalinks change
+
+        :param start: index of the first item of the page
+        :param size: number of items of the page
+        """
+        boundaries = self.queryset.values_list('master_id', 'language_code')
+        first = boundaries[start:start + 1]
+        if not first:
+            return
+        first = first[0]
+        rows = self.queryset.filter(
+            models.Q(master_id__gt=first[0]) |
+            models.Q(master_id=first[0], language_code__gte=first[1])
+        )
+        following = boundaries[start + size:start + size + 1]
+        if following:
+            following = following[0]
+            rows = rows.filter(
+                models.Q(master_id__lt=following[0]) |
+                models.Q(master_id=following[0], language_code__lt=following[1])
+            )
+        patterns = sorted(set(
+            self.sitemap.get_pattern(pk) for pk in self.sitemap.configs
+            if not self.sitemap.namespace or
+            self.sitemap.configs[pk].namespace == self.sitemap.namespace
+        ))
+        aggregates = {
+            'count': models.Count('pk', distinct=True),
+            'modified': models.Max('master__date_modified'),
+        }
+        if any('<category>' in pattern for pattern in patterns):
+            # category slugs are part of the URLs
+            aggregates['categories'] = models.Max('master__categories__date_modified')
+        data = rows.order_by().aggregate(**aggregates)
+        signature = '{0}:{1}:{2}:{3}:{4}:{5}'.format(
+            first[0], first[1], data['count'], data['modified'], data.get('categories'),
+            '|'.join(patterns)
+        )
+        return hashlib.md5(force_bytes(signature)).hexdigest()
+
+    def _get_categories(self, rows):
+        """
+        Return the slug of the main category of the posts whose permalink need it
+        """
+        post_ids = [
+            row['master_id'] for row in rows
+            if '<category>' in self.sitemap.get_pattern(row['master__app_config_id'])
+        ]
+        if not post_ids:
+            return {}
+        main_categories = {}
+        relations = Post.categories.through.objects.filter(
+            post_id__in=post_ids
+        ).values_list('post_id', 'blogcategory_id')
+        for post_id, category_id in relations:
+            main_categories[post_id] = min(category_id, main_categories.get(post_id, category_id))
+        slugs = {}
+        translations = BlogCategory._parler_meta.root_model.objects.filter(
+            master_id__in=set(main_categories.values())
+        ).order_by('language_code').values_list('master_id', 'language_code', 'slug')
+        for category_id, language, slug in translations:
+            slugs.setdefault(category_id, {})[language] = slug
+        categories = {}
+        for row in rows:
+            category_slugs = slugs.get(main_categories.get(row['master_id']))
+            if category_slugs:
+                categories[row['master_id'], row['language_code']] = category_slugs.get(
+                    row['language_code'], sorted(category_slugs.items())[0][1]
+                )
+        return categories
+
+
 class BlogSitemap(Sitemap):
+    """
+    Sitemap of the published posts.
+
+    By default all the languages and the blog namespaces are included: use
+    :py:class:`BlogSitemaps` to get a sitemap section per language and namespace.
+    """
+
+    def __init__(self, language=None, namespace=None):
+        self.language = language
+        self.namespace = namespace
+        self._configs = None
+        self._prefixes = {}
+
+    @property
+    def configs(self):
+        if self._configs is None:
+            self._configs = dict((config.pk, config) for config in BlogConfig.objects.all())
+        return self._configs
+
+    def get_pattern(self, app_config_id):
+        return get_setting('PERMALINK_URLS')[self.configs[app_config_id].url_patterns]
+
+    def get_location(self, row, category=None):
+        """
+        Compute the post URL from the item data reversing a single URL per namespace and
+        language
+        """
+        config = self.configs[row['master__app_config_id']]
+        language = row['language_code']
+        pattern = self.get_pattern(config.pk)
+        kwargs = get_permalink_kwargs(
+            pattern, row['master__date_published'] or row['master__date_created'],
+            row['slug'], category
+        )
+        path = get_permalink_format(pattern)
+        with override(language):
+            if path is None or ('<category>' in pattern and not category):
+                # posts with no category use the slug only permalink
+                return reverse('%s:post-detail' % config.namespace, kwargs=kwargs)
+            if (config.namespace, language) not in self._prefixes:
+                self._prefixes[config.namespace, language] = reverse(
+                    '%s:posts-latest' % config.namespace
+                )
+        kwargs = dict((key, urlquote(value)) for key, value in kwargs.items())
+        return self._prefixes[config.namespace, language] + path.format(**kwargs)
 
     def priority(self, obj):
-        if obj and obj.app_config:
-            return obj.app_config.sitemap_priority
+        if obj and obj['app_config_id']:
+            return self.configs[obj['app_config_id']].sitemap_priority
         return get_setting('SITEMAP_PRIORITY_DEFAULT')
 
     def changefreq(self, obj):
-        if obj and obj.app_config:
-            return obj.app_config.sitemap_changefreq
+        if obj and obj['app_config_id']:
+            return self.configs[obj['app_config_id']].sitemap_changefreq
         return get_setting('SITEMAP_CHANGEFREQ_DEFAULT')
 
     def location(self, obj):
-        with smart_override(obj.get_current_language()):
-            return obj.get_absolute_url(obj.get_current_language())
+        return obj['location']
 
     def items(self):
-        items = []
-        for lang in get_language_list():
-            items.extend(Post.objects.translated(lang).language(lang).published())
-        return items
+        self._configs = None
+        self._prefixes = {}
+        languages = [self.language] if self.language else get_language_list()
+        posts = Post.objects.published()
+        if self.namespace:
+            posts = posts.namespace(self.namespace)
+        queryset = Post._parler_meta.root_model.objects.filter(
+            language_code__in=languages, master__in=posts.values('pk')
+        ).order_by('master_id', 'language_code')
+        return PostSitemapItems(self, queryset)
 
     def lastmod(self, obj):
-        return obj.date_modified
+        return obj['date_modified']
+
+
+class BlogSitemaps(Mapping):
+    """
+    Dictionary of blog sitemaps, one for each language and blog namespace, to be used as
+    sections of django sitemap index.
+
+    Sections are computed on access, thus newly created blogs are included without
+    restarting the server; the sitemap of each section is created once and reused.
+    """
+
+    def __init__(self, languages=None, **sitemaps):
+        """
+        :param languages: sitemap languages (default: all the site languages)
+        :param sitemaps: further sections to add to the index (e.g.: ``cmspages``)
+        """
+        self.languages = languages
+        self.sitemaps = sitemaps
+        self._sections = {}
+
+    def _get_sitemaps(self):
+        sitemaps = dict(self.sitemaps)
+        for namespace in BlogConfig.objects.values_list('namespace', flat=True):
+            for language in self.languages or get_language_list():
+                key = 'blog-{0}-{1}'.format(namespace, language)
+                if key not in self._sections:
+                    self._sections[key] = BlogSitemap(language, namespace)
+                sitemaps[key] = self._sections[key]
+        return sitemaps
+
+    def __getitem__(self, key):
+        return self._get_sitemaps()[key]
+
+    def __iter__(self):
+        return iter(self._get_sitemaps())
+
+    def __len__(self):
+        return len(self._get_sitemaps())
+
+    def items(self):
+        return self._get_sitemaps().items()
+
+    def values(self):
+        return self._get_sitemaps().values()
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function, unicode_literals
+
+import json
+import os
+import tempfile
+from threading import local
+
+from django.conf import settings
+from django.contrib.sites.models import Site
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.template.loader import render_to_string
+from django.utils.dateparse import parse_datetime
+from django.utils.encoding import force_bytes, force_text
+from django.utils.timezone import now
+
+from ..settings import get_setting
+from . import BlogSitemaps
+
+MANIFEST_NAME = 'manifest'
+
+_scheduled = local()
+
+
+def get_shard_path(name, site_id=None):
+    """
+    Return the storage path of the given shard (or of the manifest) of the given site
+    """
+    if site_id is None:
+        site_id = Site.objects.get_current().pk
+    return '{0}/{1}/{2}.{3}'.format(
+        get_setting('SITEMAP_SHARDS_PATH').rstrip('/'), site_id, name,
+        'json' if name == MANIFEST_NAME else 'xml'
+    )
+
+
+def load_manifest(site_id=None):
+    """
+    Return the data of the generated shards: a dictionary with the generation date of the
+    whole set (``generated``) and the section, signature and generation date of each shard
+    (``shards``)
+    """
+    path = get_shard_path(MANIFEST_NAME, site_id)
+    if not default_storage.exists(path):
+        return {'generated': None, 'shards': {}}
+    with default_storage.open(path) as manifest:
+        return json.loads(force_text(manifest.read()))
+
+
+def get_shard_last_modified(name, site_id=None):
+    """
+    Return the generation date of the given shard (or of the whole set if name is ``None``)
+    """
+    manifest = load_manifest(site_id)
+    if name is None:
+        generated = manifest['generated']
+    else:
+        generated = manifest['shards'].get(name, {}).get('generated')
+    if generated:
+        return parse_datetime(generated)
+
+
+def _write(path, content):
+    """
+    Replace the file at the given path, without a window where the file is missing
+    """
+    try:
+        full_path = default_storage.path(path)
+    except NotImplementedError:
+        full_path = None
+    if full_path is None:
+        if default_storage.get_available_name(path) != path:
+            # the storage does not overwrite existing files
+            default_storage.delete(path)
+        default_storage.save(path, ContentFile(force_bytes(content)))
+        return
+    directory = os.path.dirname(full_path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    handle, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    with os.fdopen(handle, 'wb') as temp_file:
+        temp_file.write(force_bytes(content))
+    os.chmod(temp_path, settings.FILE_UPLOAD_PERMISSIONS or 0o644)
+    # renaming is atomic, thus requests get either the old or the new file
+    getattr(os, 'replace', os.rename)(temp_path, full_path)
+
+
+def update_sitemap_shards(namespaces=None, force=False, protocol='http'):
+    """
+    Write the blog sitemaps to the storage as static files (shards), each containing up to
+    ``BLOG_SITEMAP_SHARD_SIZE`` items.
+
+    Only the shards whose posts changed (judged by their ``date_modified`` and by the
+    permalink settings) since the last run are regenerated: unchanged shards are detected by
+    an aggregate query, without fetching their items.
+
+    :param namespaces: only update the shards of the given blog namespaces
+    :param force: regenerate all the shards
+    :param protocol: protocol of the sitemap URLs
+    :return: list of regenerated shards
+    """
+    site = Site.objects.get_current()
+    manifest = load_manifest(site.pk)
+    size = get_setting('SITEMAP_SHARD_SIZE')
+    generated = now().isoformat()
+    updated = []
+    shards = {}
+    for section, sitemap in sorted(BlogSitemaps().items()):
+        if namespaces is not None and sitemap.namespace not in namespaces:
+            shards.update(
+                (name, data) for name, data in manifest['shards'].items()
+                if data['section'] == section
+            )
+            continue
+        sitemap.limit = size
+        items = sitemap.items()
+        for page, start in enumerate(range(0, len(items), size), 1):
+            name = '{0}-{1}'.format(section, page)
+            # items are only fetched for the shards whose signature changed
+            signature = items.get_signature(start, size)
+            previous = manifest['shards'].get(name)
+            if not force and previous and previous['signature'] == signature:
+                shards[name] = previous
+                continue
+            urls = sitemap.get_urls(page=page, site=site, protocol=protocol)
+            content = render_to_string('sitemap.xml', {'urlset': urls})
+            _write(get_shard_path(name, site.pk), content)
+            shards[name] = {'section': section, 'signature': signature, 'generated': generated}
+            updated.append(name)
+    removed = set(manifest['shards']).difference(shards)
+    for name in removed:
+        default_storage.delete(get_shard_path(name, site.pk))
+    if updated or removed or not manifest['generated']:
+        manifest = {'generated': generated, 'shards': shards}
+        _write(get_shard_path(MANIFEST_NAME, site.pk), json.dumps(manifest, sort_keys=True))
+    return updated
+
+
+def schedule_sitemap_shards_update(namespace):
+    """
+    Update the shards of the given blog namespace once the current transaction is committed.
+
+    Namespaces scheduled in the same transaction are updated together, thus saving a post and
+    its translations updates the shards only once.
+    """
+    if not hasattr(_scheduled, 'namespaces'):
+        _scheduled.namespaces = set()
+    _scheduled.namespaces.add(namespace)
+    transaction.on_commit(update_scheduled_sitemap_shards)
+
+
+def update_scheduled_sitemap_shards():
+    """
+    Update the shards of the namespaces scheduled by :py:func:`schedule_sitemap_shards_update`
+    """
+    namespaces = getattr(_scheduled, 'namespaces', None)
+    if namespaces:
+        _scheduled.namespaces = set()
+        return update_sitemap_shards(namespaces=namespaces)
+    return []
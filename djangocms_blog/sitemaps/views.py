@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function, unicode_literals
+
+from django.contrib.sitemaps.views import x_robots_tag
+from django.contrib.sites.shortcuts import get_current_site
+from django.core.files.storage import default_storage
+from django.core.urlresolvers import reverse
+from django.http import Http404, HttpResponse
+from django.template.response import TemplateResponse
+from django.views.decorators.http import condition
+
+from .shards import MANIFEST_NAME, get_shard_last_modified, get_shard_path, load_manifest
+
+
+def _last_modified(request, shard=None, **kwargs):
+    return get_shard_last_modified(shard, get_current_site(request).pk)
+
+
+@x_robots_tag
+@condition(last_modified_func=_last_modified)
+def index(request, template_name='sitemap_index.xml', content_type='application/xml',
+          sitemap_url_name='djangocms_blog.sitemaps.views.sitemap'):
+    """
+    Serve the index of the static sitemap files written by ``update_sitemap_shards``
+    """
+    site = get_current_site(request)
+    sitemaps = [
+        '{0}://{1}{2}'.format(
+            request.scheme, site.domain, reverse(sitemap_url_name, kwargs={'shard': shard})
+        ) for shard in sorted(load_manifest(site.pk)['shards'])
+    ]
+    return TemplateResponse(request, template_name, {'sitemaps': sitemaps},
+                            content_type=content_type)
+
+
+@x_robots_tag
+@condition(last_modified_func=_last_modified)
+def sitemap(request, shard, content_type='application/xml'):
+    """
+    Serve a static sitemap file written by ``update_sitemap_shards``
+    """
+    path = get_shard_path(shard, get_current_site(request).pk)
+    if shard == MANIFEST_NAME or not default_storage.exists(path):
+        raise Http404('No sitemap available for: %r' % shard)
+    with default_storage.open(path) as sitemap_file:
+        return HttpResponse(sitemap_file.read(), content_type=content_type)
@@ -1,20 +1,37 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, print_function, unicode_literals
 
+import hashlib
 import os.path
+from datetime import datetime
+from functools import partial
 
 from aldryn_apphooks_config.mixins import AppConfigMixin
 from django.apps import apps
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.sites.shortcuts import get_current_site
+from django.core.cache import cache
 from django.core.exceptions import ImproperlyConfigured
+from django.core.paginator import InvalidPage
 from django.core.urlresolvers import reverse
-from django.utils.timezone import now
+from django.db.models import Count, Max
+from django.http import Http404, HttpResponse
+from django.utils.encoding import force_bytes, force_text
+from django.utils.timezone import make_aware, now
 from django.utils.translation import get_language
+from django.views.decorators.http import condition
 from django.views.generic import DetailView, ListView
 from parler.views import TranslatableSlugMixin, ViewUrlMixin
 
+from .caching import get_posts_cache_key, get_tagged, set_tagged
+from .category_tree import get_category_tree
 from .models import BlogCategory, Post
-from .settings import get_setting
+from .pagination import KeysetPaginator
+from .settings import (
+    PAGINATION_COUNT_EXACT, PAGINATION_COUNT_NONE, PAGINATION_KEYSET, PAGINATION_OFFSET,
+    get_setting,
+)
 
 User = get_user_model()
 
@@ -56,15 +73,126 @@ class BaseBlogView(AppConfigMixin, ViewUrlMixin):
 class BaseBlogListView(BaseBlogView):
     context_object_name = 'post_list'
     base_template_name = 'post_list.html'
+    cache_tags = ()
+
+    def get(self, request, *args, **kwargs):
+        key = self.get_response_cache_key()
+        if key:
+            cached = get_tagged(key)
+            if cached is not None:
+                response = HttpResponse(cached['content'])
+                for header, value in cached['headers']:
+                    response[header] = value
+                return response
+        response = super(BaseBlogListView, self).get(request, *args, **kwargs)
+        if key:
+            response.add_post_render_callback(partial(self._cache_response, key))
+        return response
+
+    def get_response_cache_key(self):
+        """
+        Return the key of the cached response, or ``None`` if the response is not cacheable:
+        cache disabled by ``BLOG_LIST_CACHE_TIMEOUT``, authenticated users, toolbar edit mode
+        or query parameters other than the page
+        """
+        request = self.request
+        toolbar = getattr(request, 'toolbar', None)
+        if (not get_setting('LIST_CACHE_TIMEOUT') or request.method not in ('GET', 'HEAD') or
+                request.user.is_authenticated() or (toolbar and toolbar.edit_mode) or
+                set(request.GET).difference([self.page_kwarg])):
+            return
+        parts = [force_text(self.kwargs[key]) for key in sorted(self.kwargs)]
+        parts.append(force_text(request.GET.get(self.page_kwarg, '')))
+        return 'djangocms-blog:list-view:{0}:{1}:{2}:{3}:{4}'.format(
+            self.__class__.__name__, self.namespace, get_language(),
+            get_current_site(request).pk, hashlib.md5(force_bytes('/'.join(parts))).hexdigest()
+        )
+
+    def get_cache_tags(self, posts):
+        """
+        Return the tags of the cached response: the blog, the displayed posts and categories
+        and the tags of the list itself (see :py:meth:`get_list_cache_tags`)
+        """
+        tags = ['blog:{0}'.format(self.config.pk)]
+        for post in posts:
+            tags.append('post:{0}'.format(post.pk))
+            tags.extend('category:{0}'.format(category.pk) for category in post.categories.all())
+        return tags + self.get_list_cache_tags()
+
+    def get_list_cache_tags(self):
+        """
+        Return the tags invalidated when a post is added to or removed from the list
+        """
+        return ['blog-posts:{0}'.format(self.config.pk)]
+
+    def _cache_response(self, key, response):
+        if response.status_code == 200 and not self.request.META.get('CSRF_COOKIE_USED'):
+            set_tagged(
+                key, {'content': response.content, 'headers': list(response.items())},
+                self.cache_tags, get_setting('LIST_CACHE_TIMEOUT')
+            )
+
+    def get_queryset(self):
+        return super(BaseBlogListView, self).get_queryset().list_ready()
 
     def get_context_data(self, **kwargs):
         context = super(BaseBlogListView, self).get_context_data(**kwargs)
         context['TRUNCWORDS_COUNT'] = get_setting('POSTS_LIST_TRUNCWORDS_COUNT')
+        if context.get(self.context_object_name) is not None:
+            self.model.get_absolute_urls(context[self.context_object_name])
+            self.cache_tags = self.get_cache_tags(context[self.context_object_name])
         return context
 
     def get_paginate_by(self, queryset):
         return (self.config and self.config.paginate_by) or get_setting('PAGINATION')
 
+    def get_pagination_mode(self):
+        """
+        Return the pagination mode of the blog; keyset pagination is not used in toolbar edit
+        mode, as unpublished posts may lack the publication date
+        """
+        toolbar = getattr(self.request, 'toolbar', None)
+        if toolbar and toolbar.edit_mode:
+            return PAGINATION_OFFSET
+        return (self.config and self.config.pagination_mode) or get_setting('PAGINATION_MODE')
+
+    def get_pagination_count(self, queryset):
+        """
+        Return the callable computing the total number of posts of keyset paginated lists,
+        according to the blog ``pagination_count`` option, or ``None`` to skip the count
+        """
+        mode = (self.config and self.config.pagination_count) or get_setting('PAGINATION_COUNT')
+        if mode == PAGINATION_COUNT_NONE:
+            return
+        if mode == PAGINATION_COUNT_EXACT:
+            return queryset.count
+
+        def count():
+            parts = [force_text(self.kwargs[key]) for key in sorted(self.kwargs)
+                     if key != self.page_kwarg]
+            key = get_posts_cache_key(
+                'list-count', self.__class__.__name__, self.namespace, get_language(),
+                get_current_site(self.request).pk,
+                hashlib.md5(force_bytes('/'.join(parts))).hexdigest()
+            )
+            total = cache.get(key)
+            if total is None:
+                total = queryset.count()
+                cache.set(key, total, get_setting('PAGINATION_COUNT_TIMEOUT'))
+            return total
+        return count
+
+    def paginate_queryset(self, queryset, page_size):
+        if self.get_pagination_mode() != PAGINATION_KEYSET:
+            return super(BaseBlogListView, self).paginate_queryset(queryset, page_size)
+        paginator = KeysetPaginator(queryset, page_size, self.get_pagination_count(queryset))
+        cursor = self.kwargs.get(self.page_kwarg) or self.request.GET.get(self.page_kwarg)
+        try:
+            page = paginator.page(cursor)
+        except InvalidPage as e:
+            raise Http404('Invalid page: {0}'.format(force_text(e)))
+        return paginator, page, page.object_list, page.has_other_pages()
+
 
 class PostDetailView(TranslatableSlugMixin, BaseBlogView, DetailView):
     context_object_name = 'post'
@@ -84,23 +212,81 @@ class PostDetailView(TranslatableSlugMixin, BaseBlogView, DetailView):
             return super(PostDetailView, self).get_template_names()
 
     def get_queryset(self):
-        queryset = self.model._default_manager.all()
+        queryset = self.model._default_manager.list_ready().select_related('main_image_full')
         if not getattr(self.request, 'toolbar', False) or not self.request.toolbar.edit_mode:
             queryset = queryset.published()
         return queryset
 
-    def get(self, *args, **kwargs):
+    def get_object(self, queryset=None):
+        """
+        Return the post, retrieving it only once per request
+        """
+        if queryset is not None:
+            return super(PostDetailView, self).get_object(queryset)
+        cached = getattr(self, '_cached_object', None)
+        if not cached or cached[0] != self.kwargs:
+            self._cached_object = (
+                dict(self.kwargs), super(PostDetailView, self).get_object()
+            )
+        return self._cached_object[1]
+
+    def get_validators(self):
+        """
+        Return the ETag and the last modification date of the post, computed from the post and
+        its placeholders plugins with a single query without fetching the post.
+
+        Validators are not computed for authenticated users (whose page may change
+        independently from the post) and instant articles.
+
+        :return: tuple of ETag and last modification date, or ``None``
+        """
+        if (self.instant_article or self.request.user.is_authenticated() or
+                self.slug_url_kwarg not in self.kwargs):
+            return
+        row = self.model._default_manager.published().filter(
+            translations__language_code=get_language(),
+            **{'translations__%s' % self.slug_field: self.kwargs[self.slug_url_kwarg]}
+        ).values('pk', 'date_modified').annotate(
+            content_changed=Max('content__cmsplugin__changed_date'),
+            content_plugins=Count('content__cmsplugin', distinct=True),
+            liveblog_changed=Max('liveblog__cmsplugin__changed_date'),
+            liveblog_plugins=Count('liveblog__cmsplugin', distinct=True),
+        ).order_by().first()
+        if not row:
+            return
+        dates = [row['date_modified'], row['content_changed'], row['liveblog_changed']]
+        last_modified = max(date for date in dates if date)
+        data = '{0}:{1}:{2}:{3}:{4}'.format(
+            row['pk'], get_language(), row['content_plugins'], row['liveblog_plugins'],
+            ':'.join(date.isoformat() if date else '' for date in dates)
+        )
+        etag = hashlib.md5(force_bytes(data)).hexdigest()
+        return etag, last_modified
+
+    def get(self, request, *args, **kwargs):
+        validators = self.get_validators()
+        if validators:
+            # unchanged posts get a 304 response before being fetched and rendered
+            etag, last_modified = validators
+            return condition(
+                etag_func=lambda *args, **kwargs: etag,
+                last_modified_func=lambda *args, **kwargs: last_modified,
+            )(self._get)(request, *args, **kwargs)
+        return self._get(request, *args, **kwargs)
+
+    def _get(self, request, *args, **kwargs):
         # submit object to cms to get corrent language switcher and selected category behavior
         if hasattr(self.request, 'toolbar'):
             self.request.toolbar.set_object(self.get_object())
-        return super(PostDetailView, self).get(*args, **kwargs)
+        return super(PostDetailView, self).get(request, *args, **kwargs)
 
     def get_context_data(self, **kwargs):
         context = super(PostDetailView, self).get_context_data(**kwargs)
-        context['meta'] = self.get_object().as_meta()
+        context['meta'] = self.object.as_meta()
         context['instant_article'] = self.instant_article
         context['use_placeholder'] = get_setting('USE_PLACEHOLDER')
-        setattr(self.request, get_setting('CURRENT_POST_IDENTIFIER'), self.get_object())
+        setattr(self.request, get_setting('CURRENT_POST_IDENTIFIER'), self.object)
+        setattr(self.request, get_setting('CURRENT_NAMESPACE'), self.config)
         return context
 
 
@@ -114,12 +300,38 @@ class PostArchiveView(BaseBlogListView, ListView):
     allow_future = True
     view_url_name = 'djangocms_blog:posts-archive'
 
+    def get_date_range(self):
+        """
+        Return the half-open range of datetimes (in the current timezone) of the requested
+        year or month, thus the filter can use the index on the date field
+
+        :return: tuple of start and end datetimes, or ``None`` if no year is requested
+        """
+        if 'year' not in self.kwargs:
+            return
+        year = int(self.kwargs['year'])
+        month = int(self.kwargs['month']) if 'month' in self.kwargs else None
+        try:
+            if month is not None:
+                start = datetime(year, month, 1)
+                end = datetime(year + month // 12, month % 12 + 1, 1)
+            else:
+                start = datetime(year, 1, 1)
+                end = datetime(year + 1, 1, 1)
+        except ValueError:
+            raise Http404('Invalid date: {0}/{1}'.format(year, month))
+        if settings.USE_TZ:
+            start, end = make_aware(start), make_aware(end)
+        return start, end
+
     def get_queryset(self):
         qs = super(PostArchiveView, self).get_queryset()
-        if 'month' in self.kwargs:
-            qs = qs.filter(**{'%s__month' % self.date_field: self.kwargs['month']})
-        if 'year' in self.kwargs:
-            qs = qs.filter(**{'%s__year' % self.date_field: self.kwargs['year']})
+        date_range = self.get_date_range()
+        if date_range:
+            qs = qs.filter(**{
+                '%s__gte' % self.date_field: date_range[0],
+                '%s__lt' % self.date_field: date_range[1],
+            })
         return qs
 
     def get_context_data(self, **kwargs):
@@ -134,6 +346,9 @@ class PostArchiveView(BaseBlogListView, ListView):
 class TaggedListView(BaseBlogListView, ListView):
     view_url_name = 'djangocms_blog:posts-tagged'
 
+    def get_list_cache_tags(self):
+        return ['tag-posts:{0}'.format(self.kwargs['tag'])]
+
     def get_queryset(self):
         qs = super(TaggedListView, self).get_queryset()
         return qs.filter(tags__slug=self.kwargs['tag'])
@@ -155,8 +370,13 @@ class AuthorEntriesView(BaseBlogListView, ListView):
             qs = qs.filter(**{'author__%s' % self.username_field: self.kwargs['username']})
         return qs
 
+    def get_list_cache_tags(self):
+        return ['author-posts:{0}'.format(self.author.pk)]
+
     def get_context_data(self, **kwargs):
-        kwargs['author'] = User.objects.get(**{self.username_field: self.kwargs.get('username')})
+        kwargs['author'] = self.author = User.objects.get(
+            **{self.username_field: self.kwargs.get('username')}
+        )
         context = super(AuthorEntriesView, self).get_context_data(**kwargs)
         return context
 
@@ -165,29 +385,41 @@ class CategoryEntriesView(BaseBlogListView, ListView):
     _category = None
     view_url_name = 'djangocms_blog:posts-category'
 
+    @property
+    def category_node(self):
+        node = get_category_tree(self.namespace).get_by_slug(
+            self.kwargs['category'], get_language()
+        )
+        if not node:
+            raise Http404('No category found matching the query')
+        return node
+
     @property
     def category(self):
         if not self._category:
-            self._category = BlogCategory.objects.active_translations(
-                get_language(), slug=self.kwargs['category']
-            ).get()
+            self._category = BlogCategory.objects.get(pk=self.category_node.pk)
         return self._category
 
-    def get(self, *args, **kwargs):
-        # submit object to cms toolbar to get correct language switcher behavior
-        if hasattr(self.request, 'toolbar'):
-            self.request.toolbar.set_object(self.category)
-        return super(CategoryEntriesView, self).get(*args, **kwargs)
-
     def get_queryset(self):
         qs = super(CategoryEntriesView, self).get_queryset()
         if 'category' in self.kwargs:
-            categories = BlogCategory.get_sub_category_ids(self.category)
-            categories.append(self.category.pk)
+            node = self.category_node
+            categories = [node.pk] + list(node.tree.get_descendant_ids(node.pk))
             qs = qs.filter(categories__in=categories).distinct()
         return qs
 
+    def get_list_cache_tags(self):
+        node = self.category_node
+        categories = [node.pk] + list(node.tree.get_descendant_ids(node.pk))
+        return ['category:{0}'.format(node.pk)] + [
+            'category-posts:{0}'.format(pk) for pk in categories
+        ]
+
     def get_context_data(self, **kwargs):
+        # the category is loaded only when the response is not cached
+        # submit object to cms toolbar to get correct language switcher behavior
+        if hasattr(self.request, 'toolbar'):
+            self.request.toolbar.set_object(self.category)
         kwargs['category'] = self.category
         context = super(CategoryEntriesView, self).get_context_data(**kwargs)
         return context
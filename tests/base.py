@@ -6,6 +6,7 @@ from copy import deepcopy
 from django.contrib.auth import get_user_model
 from django.contrib.sites.models import Site
 from django.core.cache import cache
+from django.db import connection
 from djangocms_helper.base_test import BaseTestCase
 from haystack import connections
 from haystack.constants import DEFAULT_ALIAS
@@ -158,6 +159,16 @@ class BaseTest(BaseTestCase):
         cache.clear()
         super(BaseTest, self).tearDown()
 
+    def run_on_commit(self):
+        """
+        Run the callbacks registered with ``transaction.on_commit``, as test transactions are
+        never committed
+        """
+        while connection.run_on_commit:
+            callbacks, connection.run_on_commit = connection.run_on_commit, []
+            for __, callback in callbacks:
+                callback()
+
     def _get_category(self, data, category=None, lang='en'):
         data = deepcopy(data)
         for k, v in data.items():
@@ -209,6 +220,7 @@ class BaseTest(BaseTestCase):
             post1.main_image = self.create_filer_image_object()
             post1.save()
             posts.append(post1)
+        self.run_on_commit()
         return posts
 
     def get_post_index(self):
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the peak memory of the instant articles cleaner against the previous tree based one.
+
+Each cleaner runs in its own process on the same generated page::
+
+    python tests/bench_instant_articles.py [paragraphs]
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import os
+import resource
+import subprocess
+import sys
+import time
+from io import BytesIO
+
+from lxml import etree
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def tree_clean(content):
+    """
+    Cleaner used before the streaming one: the whole page tree is built and serialized
+    """
+    document = etree.iterparse(BytesIO(content), html=True)
+    for action, element in document:
+        if not (element.text and element.text.strip()) and not len(element) and element.tag == 'p':
+            element.getparent().remove(element)
+        if element.tag in ('h3', 'h4', 'h5', 'h6') and 'op-kicker' not in element.get('class', ''):
+            element.tag = 'h2'
+    return etree.tostring(document.root)
+
+
+def streaming_clean(content):
+    from djangocms_blog.instant_articles import clean_instant_article
+    return clean_instant_article(content)
+
+
+def make_page(paragraphs):
+    parts = [
+        '<!doctype html><html><head><link rel="canonical" href="http://example.com/post/"></head>'
+        '<body><article><header><h1>Title</h1><h3 class="op-kicker">Kicker</h3></header>'
+        '<div class="blog-content">'
+    ]
+    for index in range(paragraphs):
+        parts.append(
+            '<h3>Section {0}</h3><p></p><p>Lorem ipsum dolor sit amet, <b>consectetur</b> adipiscing '
+            'elit &amp; sed do eiusmod tempor incididunt ut labore et dolore magna aliqua.</p>'
+            '<figure><img src="/media/{0}.jpg"></figure>'.format(index)
+        )
+    parts.append('</div></article></body></html>')
+    return ''.join(parts).encode('utf-8')
+
+
+def run(cleaner, paragraphs):
+    page = make_page(paragraphs)
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    cleaner(page)
+    elapsed = time.time() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print('{0} {1} {2:.3f}'.format(baseline, peak, elapsed))
+
+
+def main(paragraphs):
+    print('page size: {0} KB'.format(len(make_page(paragraphs)) // 1024))
+    for name in ('tree_clean', 'streaming_clean'):
+        output = subprocess.check_output([
+            sys.executable, __file__, '--run', name, str(paragraphs)
+        ]).decode('utf-8')
+        baseline, peak, elapsed = output.split()
+        print('{0:>16}: {1:>8} KB peak memory growth, {2}s'.format(
+            name, int(peak) - int(baseline), elapsed
+        ))
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--run']:
+        run(globals()[sys.argv[2]], int(sys.argv[3]))
+    else:
+        main(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
@@ -1,12 +1,21 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, print_function, unicode_literals
 
+from copy import copy
+from datetime import timedelta
+
 from aldryn_apphooks_config.utils import get_app_instance
 from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from django.utils.translation import activate, override
 from menus.menu_pool import menu_pool
+from menus.models import CacheKey
 from parler.utils.context import smart_override, switch_language
 
+from djangocms_blog.cms_menus import BlogCategoryMenu, BlogNavModifier
+from djangocms_blog.models import Post
 from djangocms_blog.settings import (
     MENU_TYPE_CATEGORIES, MENU_TYPE_COMPLETE, MENU_TYPE_NONE, MENU_TYPE_POSTS,
 )
@@ -60,8 +69,193 @@ class MenuTest(BaseTest):
                 nodes = menu_pool.get_nodes(request)
                 nodes_url = set([node.url for node in nodes])
                 self.assertFalse(posts[0].get_absolute_url(lang) in nodes_url)
+                # unpublished posts are not in the menu
+                self.assertFalse(posts[1].get_absolute_url(lang) in nodes_url)
+
+        cache.clear()
+        posts[1].publish = True
+        posts[1].save()
+        for lang in ('en', 'it'):
+            with smart_override(lang):
+                request = self.get_page_request(pages[1], self.user, pages[1].get_absolute_url(lang))
+                nodes = menu_pool.get_nodes(request)
+                nodes_url = set([node.url for node in nodes])
                 self.assertTrue(posts[1].get_absolute_url(lang) in nodes_url)
 
+    def test_menu_nodes_queries(self):
+        """
+        Tests that the number of queries to build the menu does not depend on the number of posts
+        """
+        pages = self.get_pages()
+        self.get_posts()
+        self.app_config_1.app_data.config.menu_structure = MENU_TYPE_COMPLETE
+        self.app_config_1.save()
+        menu = BlogCategoryMenu(None)
+        menu.instance = pages[1]
+
+        with smart_override('en'):
+            request = self.get_page_request(pages[1], self.user, pages[1].get_absolute_url('en'))
+            # warm up the category tree snapshot
+            menu.get_nodes(request)
+            with CaptureQueriesContext(connection) as first:
+                nodes = menu.get_nodes(request)
+            posts_nodes = [node for node in nodes if node.id.startswith('Post-')]
+            self.assertTrue(posts_nodes)
+            for node in posts_nodes:
+                post = Post.objects.get(pk=node.id.split('-')[1])
+                self.assertEqual(node.url, post.get_absolute_url('en'))
+                self.assertEqual(node.parent_id, 'BlogCategory-{0}'.format(
+                    post.categories.order_by('pk').first().pk
+                ))
+
+            for index in range(3):
+                post = Post.objects.create(
+                    title='Menu post {0}'.format(index), slug='menu-post-{0}'.format(index),
+                    app_config=self.app_config_1, publish=True
+                )
+                post.categories.add(self.category_1)
+                post.sites.add(self.site_1)
+            with CaptureQueriesContext(connection) as second:
+                nodes = menu.get_nodes(request)
+            self.assertEqual(
+                len([node for node in nodes if node.id.startswith('Post-')]), len(posts_nodes) + 3
+            )
+            self.assertEqual(len(first), len(second))
+
+    def test_menu_posts_limits(self):
+        """
+        Tests the options bounding the number of posts in the menu
+        """
+        pages = self.get_pages()
+        self.get_posts()
+        Post.objects.all().delete()
+        menu = BlogCategoryMenu(None)
+        menu.instance = pages[1]
+        posts = []
+        for index in range(6):
+            post = Post.objects.create(
+                title='Menu post {0}'.format(index), slug='menu-post-{0}'.format(index),
+                app_config=self.app_config_1, publish=True,
+                date_published=timezone.now() - timedelta(minutes=index)
+            )
+            post.categories.add(self.cats[index % 2])
+            posts.append(post)
+        posts[5].date_published = timezone.now().replace(year=timezone.now().year - 1)
+        posts[5].save()
+
+        def get_posts_nodes(**options):
+            config = self.app_config_1.app_data.config
+            config.menu_structure = MENU_TYPE_COMPLETE
+            config.menu_posts_limit = options.get('limit', 0)
+            config.menu_posts_per_category = options.get('per_category', 0)
+            config.menu_posts_current_year = options.get('current_year', False)
+            self.app_config_1.save()
+            request = self.get_page_request(pages[1], self.user, pages[1].get_absolute_url('en'))
+            return [
+                int(node.id.split('-')[1]) for node in menu.get_nodes(request)
+                if node.id.startswith('Post-')
+            ]
+
+        with smart_override('en'):
+            self.assertEqual(get_posts_nodes(), [post.pk for post in posts])
+            self.assertEqual(get_posts_nodes(limit=3), [post.pk for post in posts[:3]])
+            self.assertEqual(
+                get_posts_nodes(per_category=2), [post.pk for post in posts[:4]]
+            )
+            self.assertEqual(
+                get_posts_nodes(current_year=True), [post.pk for post in posts[:5]]
+            )
+            posts[0].publish = False
+            posts[0].save()
+            self.assertEqual(
+                get_posts_nodes(limit=2, per_category=1), [post.pk for post in posts[1:3]]
+            )
+
+    def test_menu_cache_invalidation(self):
+        """
+        Tests that menu cache is only cleared for the sites affected by changes
+        """
+        pages = self.get_pages()
+        posts = self.get_posts()
+        self.reload_urlconf()
+
+        def get_cache_keys():
+            return set(CacheKey.objects.values_list('site', 'language'))
+
+        def build_menus():
+            menu_pool.clear(all=True)
+            for lang in ('en', 'it'):
+                with smart_override(lang):
+                    request = self.get_page_request(
+                        pages[1], self.user, pages[1].get_absolute_url(lang)
+                    )
+                    menu_pool.get_nodes(request)
+            CacheKey.objects.create(key='other-site', site=self.site_2.pk, language='en')
+            self.assertEqual(
+                get_cache_keys(),
+                set([(self.site_1.pk, 'en'), (self.site_1.pk, 'it'), (self.site_2.pk, 'en')])
+            )
+
+        build_menus()
+        posts[0].set_current_language('en')
+        posts[0].title = 'Changed title'
+        posts[0].save()
+        self.assertEqual(get_cache_keys(), set([(self.site_2.pk, 'en')]))
+        with smart_override('en'):
+            request = self.get_page_request(pages[1], self.user, pages[1].get_absolute_url('en'))
+            nodes = menu_pool.get_nodes(request)
+            self.assertTrue('Changed title' in [node.title for node in nodes])
+
+        # saving posts with no change in menu data keeps the cache
+        build_menus()
+        posts[0].meta_description = 'Changed description'
+        posts[0].save()
+        self.assertEqual(len(get_cache_keys()), 3)
+
+        # changing categories clears the menus of the site
+        posts[0].categories.add(self.cats[2])
+        self.assertEqual(get_cache_keys(), set([(self.site_2.pk, 'en')]))
+
+        build_menus()
+        self.cats[1].set_current_language('it')
+        self.cats[1].name = 'Categoria modificata'
+        self.cats[1].save()
+        self.assertEqual(get_cache_keys(), set([(self.site_2.pk, 'en')]))
+
+        # changing the publication end date (posts may expire) clears the cache
+        build_menus()
+        posts[0].date_published_end = timezone.now() + timedelta(days=1)
+        posts[0].save()
+        self.assertEqual(get_cache_keys(), set([(self.site_2.pk, 'en')]))
+
+        build_menus()
+        posts[0].publish = False
+        posts[0].save()
+        self.assertEqual(get_cache_keys(), set([(self.site_2.pk, 'en')]))
+
+        # posts shown through the language fallbacks are updated in all the menus
+        data = dict(self._post_data[1]['en'], title='English only')
+        post = self._get_post(data)
+        post.publish = True
+        post.save()
+
+        def get_titles(lang):
+            with smart_override(lang):
+                request = self.get_page_request(
+                    pages[1], self.user, pages[1].get_absolute_url(lang)
+                )
+                return [node.title for node in menu_pool.get_nodes(request)]
+
+        build_menus()
+        self.assertIn('English only', get_titles('it'))
+        post.set_current_language('en')
+        post.title = 'Fallback title'
+        post.save()
+        self.assertIn('Fallback title', get_titles('it'))
+        post.publish = False
+        post.save()
+        self.assertNotIn('Fallback title', get_titles('it'))
+
     def test_menu_options(self):
         """
         Tests menu structure based on menu_structure configuration
@@ -81,7 +275,7 @@ class MenuTest(BaseTest):
                 cats_url[lang] = set([cat.get_absolute_url() for cat in self.cats if cat.has_translation(lang)])
                 cats_with_post_url[lang] = set([cat.get_absolute_url() for cat in self.cats if cat.has_translation(lang) and cat.blog_posts.published().exists()])
                 cats_without_post_url[lang] = cats_url[lang].difference(cats_with_post_url[lang])
-                posts_url[lang] = set([post.get_absolute_url(lang) for post in posts if post.has_translation(lang) and post.app_config == self.app_config_1])
+                posts_url[lang] = set([post.get_absolute_url(lang) for post in posts if post.has_translation(lang) and post.app_config == self.app_config_1 and post.publish])
 
         # No item in the menu
         self.app_config_1.app_data.config.menu_structure = MENU_TYPE_NONE
@@ -217,3 +411,39 @@ class MenuTest(BaseTest):
 
         self.app_config_1.app_data.config.menu_structure = MENU_TYPE_COMPLETE
         self.app_config_1.save()
+
+    def test_modifier_queries(self):
+        """
+        Tests that the modifier reuses the data loaded by the view without further queries
+        """
+        pages = self.get_pages()
+        posts = self.get_posts()
+        self.app_config_1.app_data.config.menu_structure = MENU_TYPE_CATEGORIES
+        self.app_config_1.save()
+        with smart_override('en'):
+            with switch_language(posts[0], 'en'):
+                request = self.get_page_request(
+                    pages[1], self.user, path=posts[0].get_absolute_url()
+                )
+                view_obj = PostDetailView()
+                view_obj.request = request
+                view_obj.namespace, view_obj.config = get_app_instance(request)
+                view_obj.kwargs = {'slug': posts[0].slug}
+                view_obj.get(request)
+                view_obj.get_context_data()
+                nodes = menu_pool.get_nodes(request)
+                for node in nodes:
+                    node.selected = False
+                modifier = BlogNavModifier(None)
+                with self.assertNumQueries(0):
+                    modifier.modify(request, nodes, None, None, False, False)
+                category = posts[0].categories.order_by('pk').first()
+                selected = [node.id for node in nodes if node.selected]
+                self.assertEqual(selected, ['BlogCategory-{0}'.format(category.pk)])
+
+                # nodes changed in place by other modifiers are looked up again
+                index = [node.id for node in nodes].index(selected[0])
+                nodes[index] = copy(nodes[index])
+                nodes[index].selected = False
+                modifier.modify(request, nodes, None, None, False, False)
+                self.assertTrue(nodes[index].selected)
@@ -4,7 +4,7 @@ from __future__ import absolute_import, print_function, unicode_literals
 import re
 from contextlib import contextmanager
 from copy import deepcopy
-from datetime import timedelta
+from datetime import datetime, timedelta
 
 import parler
 from cms.api import add_plugin
@@ -14,18 +14,23 @@ from django.contrib import admin
 from django.contrib.auth.models import AnonymousUser
 from django.contrib.messages.middleware import MessageMiddleware
 from django.contrib.sites.models import Site
-from django.core.urlresolvers import reverse
+from django.core.management import call_command
+from django.core.urlresolvers import resolve, reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils.encoding import force_text
 from django.utils.html import strip_tags
-from django.utils.timezone import now
+from django.utils.six import StringIO
+from django.utils.timezone import now, utc
 from django.utils.translation import get_language, override
 from djangocms_helper.utils import CMS_30
 from menus.menu_pool import menu_pool
 from parler.utils.context import smart_override
 from taggit.models import Tag
 
+from djangocms_blog.category_tree import get_category_tree
 from djangocms_blog.cms_appconfig import BlogConfig, BlogConfigForm
-from djangocms_blog.models import BlogCategory, Post
+from djangocms_blog.models import BlogCategory, Post, PostCount
 from djangocms_blog.settings import MENU_TYPE_NONE, get_setting
 
 from .base import BaseTest
@@ -485,6 +490,7 @@ class ModelsTest(BaseTest):
             name='category 2', app_config=self.app_config_1
         )
         posts[1].categories.add(new_category)
+        self.run_on_commit()
 
         with self.settings(SITE_ID=2):
             self.assertEqual(new_category.count, 1)
@@ -501,6 +507,174 @@ class ModelsTest(BaseTest):
             self.assertEqual(new_category.count_all_sites, 1)
             self.assertEqual(self.category_1.count_all_sites, 2)
 
+    def test_post_counts(self):
+        posts = self.get_posts()
+        posts[1].publish = True
+        posts[1].save()
+        posts[0].tags.add('tag 1', 'tag 2')
+        posts[1].tags.add('tag 1')
+        posts[1].sites.add(self.site_2)
+        self.run_on_commit()
+        tag_1 = Tag.objects.get(slug='tag-1')
+        tag_2 = Tag.objects.get(slug='tag-2')
+        tags = [tag_1.pk, tag_2.pk]
+        site_1 = Site.objects.get(pk=1)
+
+        def get_counts(kind, object_ids, **kwargs):
+            return PostCount.objects.get_counts(kind, object_ids, self.app_config_1, **kwargs)
+
+        self.assertEqual(get_counts(PostCount.TAG, tags), {tag_1.pk: 2, tag_2.pk: 1})
+        self.assertEqual(get_counts(PostCount.TAG, tags, site=site_1), {tag_1.pk: 1, tag_2.pk: 1})
+        self.assertEqual(
+            get_counts(PostCount.TAG, tags, site=self.site_2), {tag_1.pk: 2, tag_2.pk: 1}
+        )
+        self.assertEqual(get_counts(PostCount.AUTHOR, [self.user.pk]), {self.user.pk: 2})
+        self.assertEqual(get_counts(PostCount.CATEGORY, [self.category_1.pk], language='it'),
+                         {self.category_1.pk: 2})
+
+        posts[0].tags.remove('tag 2')
+        self.run_on_commit()
+        self.assertEqual(get_counts(PostCount.TAG, tags), {tag_1.pk: 2})
+        posts[1].publish = False
+        posts[1].save()
+        self.run_on_commit()
+        self.assertEqual(get_counts(PostCount.TAG, tags), {tag_1.pk: 1})
+        self.category_1.blog_posts.clear()
+        self.run_on_commit()
+        self.assertEqual(get_counts(PostCount.CATEGORY, [self.category_1.pk]), {})
+        posts[0].categories.add(self.category_1)
+        self.run_on_commit()
+        self.assertEqual(get_counts(PostCount.CATEGORY, [self.category_1.pk]),
+                         {self.category_1.pk: 1})
+
+        PostCount.objects.all().delete()
+        call_command('rebuild_blog_counts', stdout=StringIO())
+        self.assertEqual(get_counts(PostCount.TAG, tags), {tag_1.pk: 1})
+        self.assertEqual(get_counts(PostCount.CATEGORY, [self.category_1.pk]),
+                         {self.category_1.pk: 1})
+
+        # scheduled posts are counted once their publication date is reached, without
+        # refreshing the counters (update() sends no signal)
+        posts[1].publish = True
+        posts[1].date_published = now() + timedelta(days=1)
+        posts[1].save()
+        self.run_on_commit()
+        self.assertEqual(get_counts(PostCount.TAG, tags), {tag_1.pk: 1})
+        Post.objects.filter(pk=posts[1].pk).update(date_published=now() - timedelta(days=1))
+        self.assertEqual(get_counts(PostCount.TAG, tags), {tag_1.pk: 2})
+        # expiring posts are not counted once their publication end date is reached
+        posts[1] = self.reload_model(posts[1])
+        posts[1].date_published_end = now() + timedelta(days=1)
+        posts[1].save()
+        self.run_on_commit()
+        self.assertEqual(get_counts(PostCount.TAG, tags), {tag_1.pk: 2})
+        Post.objects.filter(pk=posts[1].pk).update(date_published_end=now() - timedelta(days=1))
+        self.assertEqual(get_counts(PostCount.TAG, tags), {tag_1.pk: 1})
+
+        # posts removed from a site on the site side
+        accessor = Post._meta.get_field('sites').remote_field.get_accessor_name()
+        getattr(site_1, accessor).add(posts[0])
+        self.run_on_commit()
+        self.assertEqual(get_counts(PostCount.TAG, tags, site=self.site_2), {})
+        getattr(site_1, accessor).clear()
+        self.run_on_commit()
+        self.assertEqual(get_counts(PostCount.TAG, tags, site=self.site_2), {tag_1.pk: 1})
+
+    def test_post_counts_batched(self):
+        posts = self.get_posts()
+        table = PostCount._meta.db_table
+
+        def refreshed():
+            with CaptureQueriesContext(connection) as queries:
+                self.run_on_commit()
+            return len([
+                query for query in queries.captured_queries
+                if query['sql'].startswith('DELETE FROM "{0}"'.format(table))
+            ])
+
+        # changes not affecting the published posts don't refresh the counters
+        posts[0].set_current_language('en')
+        posts[0].title = 'Changed title'
+        posts[0].save()
+        self.assertEqual(refreshed(), 0)
+
+        # post, translations and relations changes refresh each counter once
+        posts[1].publish = True
+        posts[1].save()
+        posts[1].create_translation('fr', title='Deuxième article')
+        posts[1].tags.add('tag 1')
+        posts[1].categories.remove(self.category_1)
+        posts[1].categories.add(self.category_1)
+        self.assertEqual(refreshed(), len(PostCount.KINDS))
+        self.assertEqual(refreshed(), 0)
+        self.assertEqual(
+            PostCount.objects.get_counts(PostCount.TAG, [Tag.objects.get(slug='tag-1').pk]),
+            {Tag.objects.get(slug='tag-1').pk: 1}
+        )
+
+        # only the counters of the changed relations are refreshed
+        posts[0].tags.add('tag 2')
+        self.assertEqual(refreshed(), 1)
+
+    def test_category_tree(self):
+        root = BlogCategory.objects.create(name='root', app_config=self.app_config_1)
+        child = BlogCategory.objects.create(name='child', parent=root, app_config=self.app_config_1)
+        grandchild = BlogCategory.objects.create(
+            name='grandchild', parent=child, app_config=self.app_config_1
+        )
+        other = BlogCategory.objects.create(name='other', app_config=self.app_config_1)
+
+        self.assertEqual(root.path, '{0}/'.format(root.pk))
+        self.assertEqual(grandchild.path, '{0}/{1}/{2}/'.format(root.pk, child.pk, grandchild.pk))
+        self.assertEqual(set(root.descendants()), set([child, grandchild]))
+        self.assertEqual(other.descendants(), [])
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                set(BlogCategory.get_sub_category_ids(root)), set([child.pk, grandchild.pk])
+            )
+
+        # moving a subtree updates the paths of all its descendants
+        child.parent = other
+        child.save()
+        grandchild = self.reload_model(grandchild)
+        self.assertEqual(grandchild.path, '{0}/{1}/{2}/'.format(other.pk, child.pk, grandchild.pk))
+        self.assertEqual(root.descendants(), [])
+        self.assertEqual(set(other.descendants()), set([child, grandchild]))
+
+        # deleting a category removes its subtree
+        other.delete()
+        self.assertFalse(BlogCategory.objects.filter(pk__in=[child.pk, grandchild.pk]).exists())
+        root.delete()
+
+    def test_category_tree_snapshot(self):
+        from djangocms_blog import cms_menus  # NOQA: connects the invalidation handlers
+        parent = BlogCategory.objects.create(name='parent', app_config=self.app_config_1)
+        child = BlogCategory.objects.create(name='child', parent=parent, app_config=self.app_config_1)
+        BlogCategory.objects.create(name='other blog', app_config=self.app_config_2)
+
+        tree = get_category_tree(self.app_config_1.namespace)
+        with self.assertNumQueries(0):
+            self.assertIs(get_category_tree(self.app_config_1.namespace), tree)
+            self.assertEqual(set(tree.nodes), set([self.category_1.pk, parent.pk, child.pk]))
+            self.assertEqual(tree.get_descendant_ids(parent.pk), set([child.pk]))
+            self.assertEqual(tree.get_by_slug('child', 'en').pk, child.pk)
+            self.assertEqual(tree.get_by_slug('categoria-1', 'it').pk, self.category_1.pk)
+            self.assertIsNone(tree.get_by_slug('other-blog', 'en'))
+            self.assertEqual(tree.get(child.pk).get_name('it'), 'child')
+
+        # saving a category translation rebuilds the snapshot
+        child.set_current_language('it', initialize=True)
+        child.name = 'figlio'
+        child.save()
+        tree = get_category_tree(self.app_config_1.namespace)
+        self.assertEqual(tree.get(child.pk).get_name('it'), 'figlio')
+        self.assertEqual(tree.get_by_slug('figlio', 'it').pk, child.pk)
+
+        child.delete()
+        tree = get_category_tree(self.app_config_1.namespace)
+        self.assertEqual(tree.get_descendant_ids(parent.pk), set())
+        parent.delete()
+
     def test_model_attributes(self):
         self.get_pages()
 
@@ -659,6 +833,11 @@ class ModelsTest(BaseTest):
                 post.get_absolute_url()
             )
         )
+        # posts with no category use the slug only permalink
+        post.categories.clear()
+        with smart_override('en'):
+            self.assertEqual(resolve(post.get_absolute_url()).kwargs, {'slug': post.slug})
+        post.categories.add(self.category_1)
 
         # slug only
         self.app_config_1.app_data.config.url_patterns = 'category'
@@ -666,6 +845,19 @@ class ModelsTest(BaseTest):
         post.app_config = self.app_config_1
         self.assertTrue(re.match(r'.*/%s/$' % post.slug, post.get_absolute_url()))
 
+        # bulk computed urls match the reversed ones
+        self._get_post(self._post_data[1]['en'])
+        self._get_post(self._post_data[2]['en']).categories.clear()
+        for url_patterns in ('full_date', 'short_date', 'category', 'slug'):
+            self.app_config_1.app_data.config.url_patterns = url_patterns
+            self.app_config_1.save()
+            for lang in ('en', 'it'):
+                expected = [item.get_absolute_url(lang) for item in Post.objects.order_by('pk')]
+                items = list(Post.objects.order_by('pk').list_ready())
+                with self.assertNumQueries(0):
+                    self.assertEqual(Post.get_absolute_urls(items, lang), expected)
+                    self.assertEqual([item.get_absolute_url(lang) for item in items], expected)
+
     def test_manager(self):
         self.get_pages()
         post1 = self._get_post(self._post_data[0]['en'])
@@ -709,6 +901,19 @@ class ModelsTest(BaseTest):
             self.assertEqual(data['count'], 2)
         post2.sites.clear()
 
+        # months are grouped by the database, falling back to date_modified
+        Post.objects.filter(pk=post1.pk).update(
+            date_published=datetime(2015, 3, 31, 12, tzinfo=utc)
+        )
+        Post.objects.filter(pk=post2.pk).update(date_published=None)
+        with self.assertNumQueries(2):
+            months = Post.objects.get_months(current_site=False)
+        self.assertEqual(
+            [(data['date'].year, data['date'].month, data['count']) for data in months],
+            [(now().year, now().month, 1), (2015, 3, 1)]
+        )
+        Post.objects.filter(pk=post1.pk).update(date_published=post1.date_published)
+
         self.assertEqual(len(Post.objects.available()), 1)
 
         # If post is published but publishing date is in the future
@@ -808,6 +1013,34 @@ class ModelsTest(BaseTest):
             list(Post.objects.filter(pk__in=(post1.pk, post2.pk)).order_by('pk').values_list('pk'))
         )
 
+        post2.publish = True
+        post2.save()
+        with self.assertNumQueries(1):
+            cloud = Post.objects.tag_cloud(queryset=Post.objects.published(), limit=3)
+        self.assertEqual(
+            [(tag.slug, tag.count) for tag in cloud], [('tag-2', 2), ('tag-1', 1), ('tag-3', 1)]
+        )
+
+        # only the posts of the given queryset are counted
+        post2.app_config = self.app_config_2
+        post2.save()
+        cloud = Post.objects.tag_cloud(queryset=Post.objects.namespace('sample_app').published())
+        self.assertEqual(
+            [(tag.slug, tag.count) for tag in cloud],
+            [('tag-1', 1), ('tag-2', 1), ('tag-3', 1), ('tag-4', 1)]
+        )
+
+        # sliced querysets are accepted
+        cloud = Post.objects.tag_cloud(
+            queryset=Post.objects.published().order_by('pk')[:1], on_site=True
+        )
+        self.assertEqual(
+            [(tag.slug, tag.count) for tag in cloud],
+            [('tag-1', 1), ('tag-2', 1), ('tag-3', 1), ('tag-4', 1)]
+        )
+        with self.assertNumQueries(1):
+            self.assertEqual(len(Post.objects.tag_list(queryset=Post.objects.filter(pk=post2.pk))), 4)
+
     def test_plugin_latest(self):
         post1 = self._get_post(self._post_data[0]['en'])
         self._get_post(self._post_data[1]['en'])
@@ -871,14 +1104,28 @@ class ModelsTest2(BaseTest):
 
         post1.publish = True
         post1.save()
+        self.run_on_commit()
         self.assertEqual(len(plugin.get_posts(request)), 1)
         self.assertEqual(plugin.get_authors()[0].count, 1)
 
         post2.publish = True
         post2.save()
+        self.run_on_commit()
         self.assertEqual(len(plugin.get_posts(request)), 2)
         self.assertEqual(plugin.get_authors()[0].count, 2)
 
+        # authors, counters and scheduled posts
+        with self.assertNumQueries(3):
+            self.assertEqual(plugin.get_authors(cached=True)[0].count, 2)
+        with self.assertNumQueries(0):
+            self.assertEqual(plugin.get_authors(cached=True)[0].count, 2)
+        post2.publish = False
+        post2.save()
+        self.run_on_commit()
+        self.assertEqual(plugin.get_authors(cached=True)[0].count, 1)
+        plugin.authors.clear()
+        self.assertEqual(plugin.get_authors(cached=True), [])
+
     def test_copy_plugin_author(self):
         post1 = self._get_post(self._post_data[0]['en'])
         post2 = self._get_post(self._post_data[1]['en'])
@@ -941,6 +1188,16 @@ class ModelsTest2(BaseTest):
         )
         self.assertEqual(force_text(plugin.__str__()), 'generic blog plugin')
 
+    def test_settings_registry(self):
+        # resolved settings are memoized
+        self.assertIs(get_setting('PERMALINK_URLS'), get_setting('PERMALINK_URLS'))
+        self.assertEqual(get_setting('PAGINATION'), 10)
+
+        # registry is rebuilt when a setting is overridden and restored afterwards
+        with self.settings(BLOG_PAGINATION=3):
+            self.assertEqual(get_setting('PAGINATION'), 3)
+        self.assertEqual(get_setting('PAGINATION'), 10)
+
 
 class KnockerTest(BaseTest):
 
@@ -41,10 +41,10 @@ class PluginTest(BaseTest):
         plugin_nocache = add_plugin(
             ph, 'BlogLatestEntriesPlugin', language='en', app_config=self.app_config_1
         )
-        with self.assertNumQueries(53):
+        with self.assertNumQueries(20):
             plugin_nocache.render_plugin(context, ph)
 
-        with self.assertNumQueries(17):
+        with self.assertNumQueries(8):
             rendered = plugin.render_plugin(context, ph)
         try:
             self.assertTrue(rendered.find('cms_plugin-djangocms_blog-post-abstract-1') > -1)
@@ -165,6 +165,7 @@ class PluginTest(BaseTest):
         posts[0].save()
         posts[1].publish = True
         posts[1].save()
+        self.run_on_commit()
         ph = pages[0].placeholders.get(slot='content')
         plugin = add_plugin(ph, 'BlogArchivePlugin', language='en', app_config=self.app_config_1)
         plugin_class = plugin.get_plugin_class_instance()
@@ -176,6 +177,7 @@ class PluginTest(BaseTest):
 
         posts[1].publish = False
         posts[1].save()
+        self.run_on_commit()
         context = plugin_class.render(context, plugin, ph)
         self.assertEqual(context['dates'][0]['date'].date(), now().replace(year=now().year, month=now().month, day=1).date())
         self.assertEqual(context['dates'][0]['count'], 1)
@@ -214,6 +216,7 @@ class PluginTest2(BaseTest):
         posts[0].save()
         posts[1].publish = True
         posts[1].save()
+        self.run_on_commit()
         ph = pages[0].placeholders.get(slot='content')
         plugin = add_plugin(ph, 'BlogAuthorPostsPlugin', language='en', app_config=self.app_config_1)
 
@@ -291,3 +294,37 @@ class PluginTest2(BaseTest):
         with self.settings(SITE_ID=2):
             context = plugin_class.render(context, plugin, ph)
             self.assertEqual(list(context['categories']), [self.category_1, new_category])
+
+    def test_blog_category_plugin_queries(self):
+        pages = self.get_pages()
+        posts = self.get_posts()
+        for index in range(5):
+            category = BlogCategory.objects.create(
+                name='category {0}'.format(index + 2), app_config=self.app_config_1
+            )
+            posts[0].categories.add(category)
+        self.run_on_commit()
+
+        ph = pages[0].placeholders.get(slot='content')
+        plugin = add_plugin(
+            ph, 'BlogCategoryPlugin', language='en', app_config=self.app_config_1
+        )
+        plugin_class = plugin.get_plugin_class_instance()
+        context = self.get_plugin_context(pages[0], 'en', plugin, edit=True)
+        # categories, counters and scheduled posts
+        with self.assertNumQueries(3):
+            context = plugin_class.render(context, plugin, ph)
+            self.assertEqual(len(context['categories']), 6)
+            self.assertEqual([category.count for category in context['categories']], [1] * 6)
+        with self.assertNumQueries(0):
+            context = plugin_class.render(context, plugin, ph)
+            self.assertEqual(len(context['categories']), 6)
+
+        # changing posts invalidates the cached list
+        posts[0].categories.remove(category)
+        self.run_on_commit()
+        with self.assertNumQueries(3):
+            context = plugin_class.render(context, plugin, ph)
+            counts = dict((cat.pk, cat.count) for cat in context['categories'])
+            self.assertEqual(counts[category.pk], 0)
+            self.assertEqual(counts[self.category_1.pk], 1)
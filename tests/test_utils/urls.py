@@ -9,12 +9,12 @@ from django.conf import settings
 from django.conf.urls import include, url
 from django.conf.urls.i18n import i18n_patterns
 from django.contrib import admin
-from django.contrib.sitemaps.views import sitemap
+from django.contrib.sitemaps.views import index, sitemap
 from django.contrib.staticfiles.urls import staticfiles_urlpatterns
 from django.views.i18n import javascript_catalog
 from django.views.static import serve
 
-from djangocms_blog.sitemaps import BlogSitemap
+from djangocms_blog.sitemaps import BlogSitemap, BlogSitemaps, views as static_sitemap
 
 admin.autodiscover()
 
@@ -30,6 +30,14 @@ urlpatterns = [
             'cmspages': CMSSitemap, 'blog': BlogSitemap,
         }
         }),
+    url(r'^sitemap-index\.xml$', index,
+        {'sitemaps': BlogSitemaps(cmspages=CMSSitemap), 'sitemap_url_name': 'sitemap-section'}),
+    url(r'^sitemap-(?P<section>.+)\.xml$', sitemap,
+        {'sitemaps': BlogSitemaps(cmspages=CMSSitemap)}, name='sitemap-section'),
+    url(r'^static-sitemap\.xml$', static_sitemap.index,
+        {'sitemap_url_name': 'static-sitemap'}),
+    url(r'^static-sitemap-(?P<shard>[\w-]+)\.xml$', static_sitemap.sitemap,
+        name='static-sitemap'),
 ]
 
 urlpatterns += staticfiles_urlpatterns()
@@ -2,25 +2,46 @@
 from __future__ import absolute_import, print_function, unicode_literals
 
 import os.path
+from datetime import timedelta
+from shutil import rmtree
+from tempfile import mkdtemp
+from threading import Timer
+from unittest import skipIf
 
 from aldryn_apphooks_config.utils import get_app_instance
 from cms.api import add_plugin
 from cms.toolbar.items import ModalItem
 from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
 from django.core.exceptions import ImproperlyConfigured
-from django.core.urlresolvers import reverse
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.urlresolvers import resolve, reverse
+from django.db import connection
 from django.http import Http404
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils.encoding import force_text
+from django.utils.six import StringIO
 from django.utils.timezone import now
 from django.utils.translation import ugettext_lazy as _
 from parler.tests.utils import override_parler_settings
 from parler.utils.conf import add_default_language_settings
 from parler.utils.context import smart_override, switch_language
 
-from djangocms_blog.feeds import FBInstantArticles, FBInstantFeed, LatestEntriesFeed, TagFeed
-from djangocms_blog.models import BLOG_CURRENT_NAMESPACE
-from djangocms_blog.settings import get_setting
-from djangocms_blog.sitemaps import BlogSitemap
+from djangocms_blog.caching import acquire_cache_lock, get_or_rebuild, release_cache_lock
+from djangocms_blog.feeds import (
+    FBInstantArticles, FBInstantFeed, LatestEntriesFeed, TagFeed, prerender_instant_articles,
+)
+from djangocms_blog.models import BLOG_CURRENT_NAMESPACE, BlogCategory, InstantArticle
+from djangocms_blog.settings import (
+    PAGINATION_COUNT_CACHED, PAGINATION_COUNT_EXACT, PAGINATION_COUNT_NONE, PAGINATION_KEYSET,
+    get_setting,
+)
+from djangocms_blog.sitemaps import BlogSitemap, BlogSitemaps, views as static_sitemap
+from djangocms_blog.sitemaps.shards import (
+    get_shard_path, load_manifest, update_scheduled_sitemap_shards, update_sitemap_shards,
+)
 from djangocms_blog.views import (
     AuthorEntriesView, CategoryEntriesView, PostArchiveView, PostDetailView, PostListView,
     TaggedListView,
@@ -103,6 +124,74 @@ class ViewTest(BaseTest):
                 )
             )), 1)
 
+    def test_post_list_view_keyset(self):
+        posts = self.get_posts()
+        pages = self.get_pages()
+        date = now().replace(microsecond=0) - timedelta(days=1)
+        for post, delta in zip(posts, (0, 0, 1)):
+            post.publish = True
+            post.date_published = date - timedelta(days=delta)
+            post.save()
+        # same date: the most recent post is the one with the highest pk
+        expected = [posts[1], posts[0], posts[2]]
+        config = self.app_config_1.app_data.config
+        config.pagination_mode = PAGINATION_KEYSET
+        config.paginate_by = 1
+        self.app_config_1.save()
+
+        def get_page(page=None, count=PAGINATION_COUNT_EXACT):
+            self.app_config_1.app_data.config.pagination_count = count
+            self.app_config_1.save()
+            request = self.get_page_request(pages[1], AnonymousUser(), lang='en', edit=False)
+            if page:
+                request.GET = {'page': page}
+            view_obj = PostListView()
+            view_obj.request = request
+            view_obj.args = ()
+            view_obj.kwargs = {}
+            view_obj.namespace, view_obj.config = get_app_instance(request)
+            view_obj.object_list = view_obj.get_queryset()
+            return view_obj.get_context_data(object_list=view_obj.object_list)
+
+        with smart_override('en'):
+            context = get_page()
+            self.assertTrue(context['is_paginated'])
+            self.assertEqual(context['paginator'].num_pages, 3)
+            self.assertEqual(context['post_list'], expected[:1])
+            self.assertFalse(context['page_obj'].has_previous())
+
+            # deep pages are fetched without offsets
+            page = context['page_obj'].next_page_number()
+            with CaptureQueriesContext(connection) as queries:
+                context = get_page(page, PAGINATION_COUNT_NONE)
+            self.assertFalse([query for query in queries if 'OFFSET' in query['sql']])
+            self.assertFalse([query for query in queries if 'COUNT(' in query['sql']])
+            self.assertIsNone(context['paginator'].num_pages)
+            self.assertEqual(context['page_obj'].number, 2)
+            self.assertEqual(context['post_list'], expected[1:2])
+            context = get_page(context['page_obj'].next_page_number())
+            self.assertEqual(context['post_list'], expected[2:])
+            self.assertEqual(context['page_obj'].number, 3)
+            self.assertFalse(context['page_obj'].has_next())
+
+            # backward
+            context = get_page(context['page_obj'].previous_page_number())
+            self.assertEqual(context['post_list'], expected[1:2])
+            self.assertEqual(context['page_obj'].previous_page_number(), 1)
+            response = context['view'].render_to_response(context)
+            self.assertContains(response, '?page={0}'.format(context['page_obj'].next_page_number()))
+            self.assertContains(response, '?page=1"')
+
+            # cached count
+            self.assertEqual(get_page(count=PAGINATION_COUNT_CACHED)['paginator'].count, 3)
+            posts[2].publish = False
+            posts[2].save()
+            self.run_on_commit()
+            self.assertEqual(get_page(count=PAGINATION_COUNT_CACHED)['paginator'].count, 2)
+
+            with self.assertRaises(Http404):
+                get_page('2.x.1.1')
+
     def test_get_view_url(self):
         posts = self.get_posts()
         pages = self.get_pages()
@@ -134,6 +223,89 @@ class ViewTest(BaseTest):
         with self.assertRaises(ImproperlyConfigured):
             view_obj_2.get_view_url()
 
+    def test_list_views_cache(self):
+        posts = self.get_posts()
+        pages = self.get_pages()
+        category = BlogCategory.objects.create(name='Other', app_config=self.app_config_1)
+        posts[0].categories.add(category)
+        self.run_on_commit()
+
+        def get(view, path, **kwargs):
+            request = self.get_page_request(pages[1], AnonymousUser(), lang='en', path=path)
+            response = view.as_view()(request, **kwargs)
+            # cached responses are plain ``HttpResponse``
+            cached = not hasattr(response, 'render')
+            if not cached:
+                response['Content-Language'] = 'en'
+                response.render()
+            # headers are cached together with the content
+            self.assertEqual(response['Content-Language'], 'en')
+            self.assertTrue(response['Content-Type'].startswith('text/html'))
+            return response.content, cached
+
+        with smart_override('en'):
+            latest_url = reverse('sample_app:posts-latest')
+            category_url = category.get_absolute_url()
+            views = (
+                (PostListView, latest_url, {}),
+                (CategoryEntriesView, category_url, {'category': category.slug}),
+            )
+            for view, path, kwargs in views:
+                self.assertFalse(get(view, path, **kwargs)[1])
+                self.assertFalse(get(view, path, **kwargs)[1])
+
+            with override_settings(BLOG_LIST_CACHE_TIMEOUT=300):
+                content, cached = get(PostListView, latest_url)
+                self.assertFalse(cached)
+                self.assertEqual(get(PostListView, latest_url), (content, True))
+                self.assertFalse(get(CategoryEntriesView, category_url, **views[1][2])[1])
+                self.assertTrue(get(CategoryEntriesView, category_url, **views[1][2])[1])
+
+                # cache hits don't load the category
+                request = self.get_page_request(
+                    pages[1], AnonymousUser(), lang='en', path=category_url
+                )
+                with CaptureQueriesContext(connection) as queries:
+                    response = CategoryEntriesView.as_view()(request, **views[1][2])
+                self.assertFalse(hasattr(response, 'render'))
+                self.assertFalse([
+                    query for query in queries.captured_queries
+                    if 'djangocms_blog_blogcategory' in query['sql']
+                ])
+
+                # changes to posts not displayed in the lists
+                posts[1].set_current_language('en')
+                posts[1].title = 'Changed title'
+                posts[1].save()
+                self.run_on_commit()
+                for view, path, kwargs in views:
+                    self.assertTrue(get(view, path, **kwargs)[1])
+
+                # changes to displayed posts
+                posts[0].set_current_language('en')
+                posts[0].title = 'Changed title'
+                posts[0].save()
+                self.run_on_commit()
+                for view, path, kwargs in views:
+                    content, cached = get(view, path, **kwargs)
+                    self.assertFalse(cached)
+                    self.assertTrue(b'Changed title' in content)
+
+                # new posts in the lists
+                posts[1].publish = True
+                posts[1].save()
+                self.run_on_commit()
+                self.assertFalse(get(PostListView, latest_url)[1])
+                self.assertTrue(get(CategoryEntriesView, category_url, **views[1][2])[1])
+                posts[1].categories.add(category)
+                self.run_on_commit()
+                self.assertFalse(get(CategoryEntriesView, category_url, **views[1][2])[1])
+
+                # authenticated users get uncached responses
+                request = self.get_page_request(pages[1], self.user, lang='en', path=latest_url)
+                response = PostListView.as_view()(request)
+                self.assertTrue(hasattr(response, 'render'))
+
     def test_post_list_view_fallback(self):
         posts = self.get_posts()
         pages = self.get_pages()
@@ -172,6 +344,34 @@ class ViewTest(BaseTest):
                 view_obj.get_context_data(object_list=view_obj.object_list)
                 self.assertEqual(view_obj.get_queryset().count(), 0)
 
+    def test_post_list_view_queries(self):
+        posts = self.get_posts()
+        pages = self.get_pages()
+        for post in posts:
+            post.tags.add('tag 1', 'tag 2')
+            post.categories.add(self.category_1)
+
+        with smart_override('en'):
+            request = self.get_page_request(pages[1], self.user, lang='en', edit=True)
+            view_obj = PostListView()
+            view_obj.request = request
+            view_obj.namespace, view_obj.config = get_app_instance(request)
+            view_obj.kwargs = {}
+            view_obj.args = ()
+            # posts, translations, categories, categories translations, tags
+            with self.assertNumQueries(5):
+                post_list = list(view_obj.get_queryset())
+            self.assertEqual(len(post_list), 3)
+            with self.assertNumQueries(0):
+                for post in post_list:
+                    self.assertEqual(post.author, self.user)
+                    self.assertTrue(post.categories.exists())
+                    self.assertEqual(post.categories.all()[0].name, 'category 1')
+                    self.assertEqual(len(post.tags.all()), 2)
+                    self.assertTrue(post.main_image.url)
+                    self.assertTrue(post.thumbnail_options())
+                    self.assertTrue(post.get_absolute_url())
+
     def test_post_detail_view(self):
         posts = self.get_posts()
         pages = self.get_pages()
@@ -210,6 +410,69 @@ class ViewTest(BaseTest):
                 self.assertEqual(context['post'].language_code, 'it')
                 self.assertTrue(context['meta'])
 
+    def test_post_detail_view_queries(self):
+        posts = self.get_posts()
+        pages = self.get_pages()
+        posts[0].tags.add('tag 1')
+
+        with smart_override('en'):
+            with switch_language(posts[0], 'en'):
+                view = PostDetailView.as_view()
+                # warm up menu and templates caches
+                request = self.get_page_request(pages[1], AnonymousUser(), lang='en', edit=False)
+                view(request, slug=posts[0].slug).render()
+
+                request = self.get_page_request(pages[1], AnonymousUser(), lang='en', edit=False)
+                with CaptureQueriesContext(connection) as queries:
+                    response = view(request, slug=posts[0].slug)
+                    response.render()
+                self.assertContains(response, posts[0].get_absolute_url())
+                post_queries = [
+                    query['sql'] for query in queries.captured_queries
+                    if query['sql'].startswith('SELECT "djangocms_blog_post"."id"') and
+                    'MAX(' not in query['sql']
+                ]
+                self.assertEqual(len(post_queries), 1)
+                # blog config, validators, post with related objects and translations, page,
+                # thumbnail and placeholder
+                self.assertEqual(len(queries), 10)
+
+    def test_post_detail_view_conditional(self):
+        posts = self.get_posts()
+        pages = self.get_pages()
+
+        with smart_override('en'):
+            with switch_language(posts[0], 'en'):
+                view = PostDetailView.as_view()
+                request = self.get_page_request(pages[1], AnonymousUser(), lang='en', edit=False)
+                response = view(request, slug=posts[0].slug)
+                response.render()
+                self.assertEqual(response.status_code, 200)
+                etag = response['ETag']
+                self.assertTrue(response['Last-Modified'])
+
+                # unchanged post: no rendering and no post fetching
+                request = self.get_page_request(pages[1], AnonymousUser(), lang='en', edit=False)
+                request.META['HTTP_IF_NONE_MATCH'] = etag
+                with CaptureQueriesContext(connection) as queries:
+                    response = view(request, slug=posts[0].slug)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(len(queries), 2)
+
+                # adding a plugin changes the validator
+                add_plugin(posts[0].content, 'TextPlugin', language='en', body='new text')
+                request = self.get_page_request(pages[1], AnonymousUser(), lang='en', edit=False)
+                request.META['HTTP_IF_NONE_MATCH'] = etag
+                response = view(request, slug=posts[0].slug)
+                response.render()
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response['ETag'], etag)
+
+                # no validators for authenticated users
+                request = self.get_page_request(pages[1], self.user, lang='en', edit=False)
+                response = view(request, slug=posts[0].slug)
+                self.assertFalse(response.has_header('ETag'))
+
     def test_post_archive_view(self):
         posts = self.get_posts()
         pages = self.get_pages()
@@ -230,6 +493,37 @@ class ViewTest(BaseTest):
             context = view_obj.get_context_data(object_list=view_obj.object_list)
             self.assertEqual(context['archive_date'].date(), now().replace(year=now().year, month=now().month, day=1).date())
 
+            # invalid months are not found, not the whole year archive
+            for month in (0, 13):
+                view_obj.kwargs = {'year': now().year, 'month': month}
+                with self.assertRaises(Http404):
+                    view_obj.get_queryset()
+
+    @skipIf(connection.vendor != 'sqlite', 'SQLite query plan')
+    def test_post_archive_view_index(self):
+        posts = self.get_posts()
+        pages = self.get_pages()
+
+        with smart_override('en'):
+            request = self.get_page_request(pages[1], AnonymousUser(), lang='en', edit=False)
+            view_obj = PostArchiveView()
+            view_obj.request = request
+            view_obj.namespace, view_obj.config = get_app_instance(request)
+            view_obj.kwargs = {'year': posts[0].date_published.year}
+            qs = view_obj.get_queryset()
+            self.assertEqual(list(qs), [posts[0]])
+
+            sql, params = qs.query.sql_with_params()
+            self.assertNotIn('django_datetime_extract', sql)
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN {0}'.format(sql), params)
+                plan = [force_text(row[-1]) for row in cursor.fetchall()]
+            # posts are searched by range on the publication index, not scanned
+            self.assertTrue([
+                step for step in plan if 'djangocms_blog_post USING INDEX' in step and
+                'app_config_id=? AND publish=? AND date_published>? AND date_published<?' in step
+            ])
+
     def test_category_entries_view(self):
         posts = self.get_posts()
         pages = self.get_pages()
@@ -357,6 +651,52 @@ class ViewTest(BaseTest):
                 feed.config = self.app_config_1
                 self.assertEqual(list(feed.items('tag-2')), [posts[0]])
 
+    def test_feed_cache(self):
+        posts = self.get_posts()
+        pages = self.get_pages()
+
+        with smart_override('en'):
+            request = self.get_page_request(pages[1], self.user, path=posts[0].get_absolute_url())
+            self.reload_urlconf()
+            feed = LatestEntriesFeed()
+            response = feed(request)
+            self.assertContains(response, posts[0].get_absolute_url())
+            self.assertTrue(response['ETag'])
+            self.assertTrue(response['Last-Modified'])
+
+            # cached response: only the blog config is fetched
+            with self.assertNumQueries(1):
+                cached = feed(request)
+            self.assertEqual(cached.content, response.content)
+
+            # conditional requests
+            request = self.get_page_request(pages[1], self.user, path=posts[0].get_absolute_url())
+            request.META['HTTP_IF_NONE_MATCH'] = response['ETag']
+            self.assertEqual(feed(request).status_code, 304)
+            request = self.get_page_request(pages[1], self.user, path=posts[0].get_absolute_url())
+            request.META['HTTP_IF_MODIFIED_SINCE'] = response['Last-Modified']
+            self.assertEqual(feed(request).status_code, 304)
+
+            # saving a post makes the cache stale: while a worker rebuilds it, the stale feed
+            # is served to the others
+            posts[0].set_current_language('en')
+            posts[0].title = 'Changed title'
+            posts[0].save()
+            self.run_on_commit()
+            request = self.get_page_request(pages[1], self.user, path=posts[0].get_absolute_url())
+            key = feed.get_cache_key(request)
+            self.assertTrue(acquire_cache_lock(key))
+            stale = feed(request)
+            self.assertEqual(stale.content, response.content)
+            self.assertEqual(stale['Warning'], '110 - "Response is Stale"')
+            release_cache_lock(key)
+            request = self.get_page_request(pages[1], self.user, path=posts[0].get_absolute_url())
+            request.META['HTTP_IF_NONE_MATCH'] = response['ETag']
+            changed = feed(request)
+            self.assertEqual(changed.status_code, 200)
+            self.assertContains(changed, 'Changed title')
+            self.assertNotEqual(changed['ETag'], response['ETag'])
+
     def test_instant_articles(self):
         self.user.first_name = 'Admin'
         self.user.last_name = 'User'
@@ -386,13 +726,153 @@ class ViewTest(BaseTest):
                 self.assertContains(xml, 'class="op-modified" datetime="{0}"'.format(
                     posts[0].date_modified.strftime(FBInstantFeed.date_format)
                 ))
-                self.assertContains(xml, '<link rel="canonical" href="{0}"/>'.format(
+                self.assertContains(xml, '<link rel="canonical" href="{0}">'.format(
                     posts[0].get_full_url()
                 ))
                 # Assert text transformation
                 self.assertContains(xml, '<h2>Ciao</h2><p>Ciao</p>')
                 self.assertContains(xml, '<a>Admin User</a>')
 
+    def test_instant_articles_clean_html(self):
+        page = (
+            '<!doctype html><html><head><title>Title</title></head><body><article><header>'
+            '<h3 class="op-kicker">Kicker</h3><h4>Header</h4><p></p></header>'
+            '<div class="blog-content"><h3>Ciao</h3><p> </p>tail<p><p></p></p>'
+            '<div><h5 class="lead">Nested</h5><p><img src="a.png"></p></div><p>Ciao</p></div>'
+            '</article></body></html>'
+        )
+        content = force_text(FBInstantArticles()._clean_html(page.encode('utf-8')))
+        # only the article body is changed
+        self.assertTrue('<h3 class="op-kicker">Kicker</h3><h4>Header</h4><p></p></header>' in content)
+        self.assertTrue(
+            '<div class="blog-content"><h2>Ciao</h2>tail<div><h2 class="lead">Nested</h2>'
+            '<p><img src="a.png"></p></div><p>Ciao</p></div>' in content
+        )
+        self.assertTrue(content.startswith('<html><head><title>Title</title></head>'))
+        self.assertTrue(content.endswith('</article></body></html>'))
+
+        # text, attributes and comments are kept escaped
+        content = FBInstantArticles()._clean_html(
+            '<div class="blog-content" title="&quot;a&quot;"><p><!-- note --></p>'
+            '<p>1 &lt; 2 &amp; 3</p></div>'.encode('utf-8')
+        )
+        self.assertTrue(
+            '<div class="blog-content" title="&quot;a&quot;"><p><!-- note --></p>'
+            '<p>1 &lt; 2 &amp; 3</p></div>' in content
+        )
+
+        # empty pages are not parsed
+        self.assertEqual(FBInstantArticles()._clean_html(b''), '')
+        self.assertEqual(FBInstantArticles()._clean_html(b' \n'), '')
+
+    def test_instant_articles_prerender(self):
+        posts = self.get_posts()
+        pages = self.get_pages()
+        add_plugin(
+            posts[0].content, 'TextPlugin', language='en', body='<h3>Ciao</h3><p></p><p>Ciao</p>'
+        )
+
+        # bodies are rendered without a request and only when missing or stale
+        rendered = prerender_instant_articles([posts[0], posts[1]])
+        self.assertEqual(sorted(language for post, language in rendered), ['en', 'it'])
+        self.assertEqual(set(post for post, language in rendered), set([posts[0]]))
+        stored = InstantArticle.objects.get(post=posts[0], language='en')
+        self.assertTrue('<h2>Ciao</h2><p>Ciao</p>' in stored.content)
+        self.assertTrue(posts[0].get_full_url() in stored.content)
+        self.assertEqual(prerender_instant_articles([posts[0]]), [])
+        self.assertEqual(len(prerender_instant_articles([posts[0]], force=True)), 2)
+        call_command('prerender_instant_articles', stdout=StringIO())
+        out = StringIO()
+        call_command('prerender_instant_articles', stdout=out)
+        self.assertEqual(out.getvalue().strip(), 'Rendered 0 instant articles')
+
+        # feed uses the stored bodies
+        InstantArticle.objects.filter(pk=stored.pk).update(content='<p>Stored body</p>')
+        with smart_override('en'):
+            with switch_language(posts[0], 'en'):
+                request = self.get_page_request(
+                    pages[1], self.user, path=posts[0].get_absolute_url()
+                )
+                xml = FBInstantArticles()(request)
+                self.assertContains(xml, '<p>Stored body</p>')
+
+        # saving the post makes the stored bodies stale, rendering them again if configured
+        posts[0].save()
+        self.run_on_commit()
+        self.assertEqual(InstantArticle.objects.get_contents([posts[0]], 'en'), {})
+        # stale bodies are used while another worker is rendering them
+        with switch_language(posts[0], 'en'):
+            key = posts[0].get_cache_key('en', 'instant-article')
+        self.assertTrue(acquire_cache_lock(key))
+        self.assertEqual(prerender_instant_articles([posts[0]], languages=['en']), [])
+        with smart_override('en'):
+            with switch_language(posts[0], 'en'):
+                request = self.get_page_request(
+                    pages[1], self.user, path=posts[0].get_absolute_url()
+                )
+                xml = FBInstantArticles()(request)
+                self.assertContains(xml, '<p>Stored body</p>')
+                self.assertEqual(xml['Warning'], '110 - "Response is Stale"')
+                release_cache_lock(key)
+                xml = FBInstantArticles()(request)
+                self.assertContains(xml, '<h2>Ciao</h2>')
+                self.assertFalse(xml.has_header('Warning'))
+        # changing the content plugins makes the stored bodies stale as well
+        self.assertEqual(len(InstantArticle.objects.get_contents([posts[0]], 'en')), 1)
+        plugin = add_plugin(posts[0].content, 'TextPlugin', language='en', body='<p>New</p>')
+        self.assertEqual(InstantArticle.objects.get_contents([posts[0]], 'en'), {})
+        prerender_instant_articles([posts[0]])
+        self.assertEqual(len(InstantArticle.objects.get_contents([posts[0]], 'en')), 1)
+        plugin.delete()
+        self.assertFalse(InstantArticle.objects.filter(post=posts[0]).exists())
+        # other plugins deletions don't touch the stored bodies
+        placeholder = pages[0].placeholders.get(slot='content')
+        plugins = [
+            add_plugin(placeholder, 'TextPlugin', language='en', body='<p>Page</p>')
+            for __ in range(2)
+        ]
+        plugins[0].delete()
+        with CaptureQueriesContext(connection) as queries:
+            plugins[1].delete()
+        self.assertFalse([
+            query for query in queries.captured_queries
+            if InstantArticle._meta.db_table in query['sql']
+        ])
+
+        # translations are rendered again when saved, with their new content
+        with override_settings(BLOG_FEED_INSTANT_PRERENDER=True):
+            posts[0].set_current_language('en')
+            posts[0].title = 'New title'
+            posts[0].save()
+        content = InstantArticle.objects.get_contents([posts[0]], 'en')[posts[0].pk]
+        self.assertTrue('<h2>Ciao</h2>' in content)
+        self.assertTrue('New title' in content)
+
+    def test_cache_rebuild_lock(self):
+        key = 'djangocms-blog:test-rebuild'
+        builds = []
+
+        def build():
+            builds.append(True)
+            return 'fresh'
+
+        # cold miss while another worker builds the value: wait for it
+        self.assertTrue(acquire_cache_lock(key))
+        timer = Timer(0.2, lambda: cache.set(key, {'version': 1, 'value': 'other'}))
+        timer.start()
+        self.assertEqual(get_or_rebuild(key, 1, build), ('other', False))
+        timer.join()
+        self.assertEqual(builds, [])
+        # the other worker is too slow: build without storing
+        cache.delete(key)
+        with override_settings(BLOG_CACHE_LOCK_WAIT=0):
+            self.assertEqual(get_or_rebuild(key, 1, build), ('fresh', False))
+        self.assertIsNone(cache.get(key))
+        release_cache_lock(key)
+        self.assertEqual(get_or_rebuild(key, 1, build), ('fresh', False))
+        self.assertEqual(cache.get(key)['value'], 'fresh')
+        self.assertEqual(len(builds), 2)
+
     def test_sitemap(self):
         posts = self.get_posts()
         self.get_pages()
@@ -406,6 +886,7 @@ class ViewTest(BaseTest):
         sitemap = BlogSitemap()
         self.assertEqual(len(sitemap.items()), 6)
         for item in sitemap.items():
+            post = posts[0].__class__.objects.get(pk=item['id'])
             self.assertEqual(sitemap.lastmod(item).date(), now().date())
             self.assertEqual(
                 sitemap.priority(item), get_setting('SITEMAP_PRIORITY_DEFAULT')
@@ -413,13 +894,143 @@ class ViewTest(BaseTest):
             self.assertEqual(
                 sitemap.changefreq(item), get_setting('SITEMAP_CHANGEFREQ_DEFAULT')
             )
-            with smart_override(item.get_current_language()):
+            with smart_override(item['language']):
                 self.assertEqual(
-                    sitemap.location(item), item.get_absolute_url()
+                    sitemap.location(item), post.get_absolute_url(item['language'])
                 )
 
-    def test_sitemap_config(self):
+    def test_sitemap_category_permalink(self):
         posts = self.get_posts()
+        self.get_pages()
+        url_patterns = self.app_config_1.url_patterns
+        self.app_config_1.app_data.config.url_patterns = 'category'
+        self.app_config_1.save()
+        posts[0].categories.add(self.category_1)
+
+        sitemap = BlogSitemap()
+        for item in sitemap.items():
+            post = posts[0].__class__.objects.get(pk=item['id'])
+            self.assertEqual(sitemap.location(item), post.get_absolute_url(item['language']))
+
+        # posts without category use the slug only permalink
+        posts[1].publish = True
+        posts[1].save()
+        posts[1].categories.clear()
+        items = sitemap.items()
+        self.assertEqual(len(items), len(list(items)))
+        item = [item for item in items if item['id'] == posts[1].pk][0]
+        with smart_override(item['language']):
+            self.assertEqual(
+                sitemap.location(item), posts[1].get_absolute_url(item['language'])
+            )
+            self.assertEqual(resolve(sitemap.location(item)).kwargs, {
+                'slug': posts[1].safe_translation_getter('slug', language_code=item['language'])
+            })
+        self.app_config_1.app_data.config.url_patterns = url_patterns
+        self.app_config_1.save()
+
+    def test_sitemap_sections(self):
+        posts = self.get_posts()
+        self.get_pages()
+        posts[1].publish = True
+        posts[1].save()
+
+        sitemaps = BlogSitemaps(languages=['en', 'it'])
+        self.assertEqual(
+            sorted(sitemaps), [
+                'blog-sample_app-en', 'blog-sample_app-it',
+                'blog-sample_app2-en', 'blog-sample_app2-it',
+            ]
+        )
+        sitemap = sitemaps['blog-sample_app-it']
+        # sections are reused, thus equal sitemaps compare equal (e.g.: when reversing URLs)
+        self.assertIs(sitemaps['blog-sample_app-it'], sitemap)
+        self.assertEqual(len(sitemap.items()), 2)
+        for item in sitemap.items():
+            self.assertEqual(item['language'], 'it')
+            self.assertEqual(item['app_config_id'], self.app_config_1.pk)
+
+        # items are fetched page by page with a constant number of queries
+        sitemap = BlogSitemap()
+        sitemap.limit = 2
+        self.assertEqual(sitemap.paginator.num_pages, 3)
+        with self.assertNumQueries(3):
+            urls = sitemap.get_urls(page=2, site=self.site_1)
+        self.assertEqual(len(urls), 2)
+
+        response = self.client.get('/sitemap-index.xml')
+        self.assertContains(response, '/sitemap-blog-sample_app-en.xml')
+        self.assertContains(response, '/sitemap-cmspages.xml')
+        response = self.client.get('/sitemap-blog-sample_app-en.xml')
+        self.assertContains(response, posts[0].get_absolute_url('en'))
+        self.assertNotContains(response, posts[0].get_absolute_url('it'))
+
+    def test_sitemap_shards(self):
+        posts = self.get_posts()
+        self.get_pages()
+        posts[1].publish = True
+        posts[1].save()
+        media_root = mkdtemp()
+        self.addCleanup(rmtree, media_root)
+
+        with override_settings(MEDIA_ROOT=media_root, BLOG_SITEMAP_SHARD_SIZE=1):
+            out = StringIO()
+            call_command('update_blog_sitemaps', stdout=out)
+            self.assertEqual(out.getvalue().strip(), 'Updated 6 sitemap files')
+            # unchanged shards are detected without fetching their items
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(update_sitemap_shards(), [])
+            self.assertFalse([
+                query for query in queries.captured_queries
+                if '"djangocms_blog_post_translation"."slug"' in query['sql']
+            ])
+
+            posts[0].save()
+            self.assertEqual(
+                sorted(update_sitemap_shards()), ['blog-sample_app-en-1', 'blog-sample_app-it-1']
+            )
+            self.assertEqual(len(update_sitemap_shards(force=True)), 6)
+
+            response = self.client.get('/static-sitemap.xml')
+            self.assertContains(response, '/static-sitemap-blog-sample_app-en-1.xml')
+            response = self.client.get('/static-sitemap-blog-sample_app-en-1.xml')
+            self.assertContains(response, posts[0].get_absolute_url('en'))
+            last_modified = response['Last-Modified']
+            response = self.client.get(
+                '/static-sitemap-blog-sample_app-en-1.xml', HTTP_IF_MODIFIED_SINCE=last_modified
+            )
+            self.assertEqual(response.status_code, 304)
+            request = self.get_page_request(None, self.user, '/static-sitemap-manifest.xml')
+            with self.assertRaises(Http404):
+                static_sitemap.sitemap(request, shard='manifest')
+
+            # permalink changes are detected as the signature includes the patterns
+            url_patterns = self.app_config_1.url_patterns
+            self.app_config_1.app_data.config.url_patterns = 'slug'
+            self.app_config_1.save()
+            self.assertEqual(len(update_sitemap_shards()), 4)
+            self.app_config_1.app_data.config.url_patterns = url_patterns
+            self.app_config_1.save()
+            self.assertEqual(len(update_sitemap_shards()), 4)
+            # files are replaced in place
+            directory = os.path.dirname(default_storage.path(get_shard_path('manifest')))
+            self.assertEqual(len(os.listdir(directory)), 7)
+
+            posts[0].delete()
+            self.assertEqual(len(update_sitemap_shards()), 2)
+            self.assertEqual(len(load_manifest()['shards']), 4)
+
+            # automatic updates run once per transaction, on commit
+            with override_settings(BLOG_SITEMAP_SHARDS_AUTO_UPDATE=True):
+                posts[1].delete()
+            self.assertEqual(len(load_manifest()['shards']), 4)
+            self.assertEqual(update_scheduled_sitemap_shards(), [])
+            self.assertEqual(len(load_manifest()['shards']), 2)
+            self.assertEqual(update_scheduled_sitemap_shards(), [])
+
+    def test_sitemap_config(self):
+        self.get_posts()
+        self.get_pages()
         self.app_config_1.app_data.config.sitemap_changefreq = 'daily'
         self.app_config_1.app_data.config.sitemap_priority = '0.2'
         self.app_config_1.save()
@@ -428,7 +1039,7 @@ class ViewTest(BaseTest):
         self.assertEqual(len(sitemap.items()), 4)
         for item in sitemap.items():
             self.assertEqual(sitemap.lastmod(item).date(), now().date())
-            if item.app_config == self.app_config_1:
+            if item['app_config_id'] == self.app_config_1.pk:
                 self.assertEqual(
                     sitemap.priority(item), '0.2'
                 )